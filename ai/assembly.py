@@ -0,0 +1,86 @@
+"""Video assembly done entirely by ffmpeg.
+
+The slideshow is described to ffmpeg's concat demuxer as a list of stills with
+per-image durations, and the narration tracks are concatenated with stream
+copy, so encoding cost and memory scale with the output instead of a Python
+frame loop. Muxing narration onto a manim render copies the video stream.
+"""
+import os
+
+from ffmpeg_tools import media_duration, run_ffmpeg, write_concat_list
+
+IMAGES_PER_SCENE = 5
+
+
+def assemble_video(scene_images: list, audio_files: list, output_filename: str = "educational_video.mp4",
+                   images_per_scene: int = IMAGES_PER_SCENE):
+    """Build the slideshow video, images_per_scene images spread evenly over each scene's narration."""
+    image_entries = []
+    for audio_index, audio_file in enumerate(audio_files):
+        images = scene_images[audio_index * images_per_scene:(audio_index + 1) * images_per_scene]
+        if not images:
+            raise ValueError(f"No images for scene {audio_index}")
+        image_duration = media_duration(audio_file) / len(images)
+        image_entries.extend((image, image_duration) for image in images)
+    # the concat demuxer ignores the duration of the last entry unless the file is repeated
+    image_entries.append((image_entries[-1][0], None))
+
+    image_list = write_concat_list(image_entries)
+    audio_list = write_concat_list([(audio_file, None) for audio_file in audio_files])
+    try:
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", image_list,
+            "-f", "concat", "-safe", "0", "-i", audio_list,
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p", "-vsync", "vfr",
+            "-c:a", "copy",
+            "-shortest", "-movflags", "+faststart",
+            output_filename,
+        ])
+    finally:
+        os.remove(image_list)
+        os.remove(audio_list)
+
+
+def encode_segment(images: list, audio_file: str, output_path: str):
+    """Encode one scene as a self-contained MPEG-TS segment for HLS playback."""
+    image_duration = media_duration(audio_file) / len(images)
+    entries = [(image, image_duration) for image in images] + [(images[-1], None)]
+    image_list = write_concat_list(entries)
+    try:
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", image_list,
+            "-i", audio_file,
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p", "-vsync", "vfr",
+            "-c:a", "aac",
+            "-shortest", "-f", "mpegts",
+            output_path,
+        ])
+    finally:
+        os.remove(image_list)
+
+
+def join_segments(segments: list, output_path: str):
+    """Remux finished MPEG-TS segments into a single MP4 without re-encoding."""
+    list_path = write_concat_list([(segment, None) for segment in segments])
+    try:
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", "-bsf:a", "aac_adtstoasc", "-movflags", "+faststart",
+            output_path,
+        ])
+    finally:
+        os.remove(list_path)
+
+
+def add_audio_to_video(video_path: str, audio_path: str, output_path: str):
+    """Add audio to the video, trimming both to the shorter of the two."""
+    run_ffmpeg([
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", "aac",
+        "-shortest", "-movflags", "+faststart",
+        output_path,
+    ])
+    print(f"Video with audio saved as: {output_path}")
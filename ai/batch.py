@@ -0,0 +1,63 @@
+"""Batches of content requests, e.g. a whole curriculum for one grade.
+
+Requests for the same topic and grade are run once and share their outcome.
+The first LLM answer of every distinct request is fetched up front in one
+batched round, then the items run BATCH_CONCURRENCY at a time against the
+shared render slots and caches. A failing item is reported in its own entry
+and never fails the rest of the batch.
+"""
+import asyncio
+import os
+
+from jobs import SUCCEEDED, FAILED
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+# concurrent chat completions used to prefetch a batch's first answers
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+
+def dedupe_key(request) -> tuple:
+    return " ".join(request.topic.lower().split()), request.grade
+
+
+async def run_batch(requests: list, prefetch, run_item, report, concurrency=BATCH_CONCURRENCY) -> dict:
+    """Run run_item(request, script) once per distinct request.
+
+    prefetch(requests) returns one prefetched script (or None) per distinct
+    request. Returns one entry per input request, in order, with either the
+    item's result or its error.
+    """
+    unique = {}
+    for request in requests:
+        unique.setdefault(dedupe_key(request), request)
+    distinct = list(unique.values())
+    print(f"Batch of {len(requests)} requests, {len(distinct)} distinct")
+
+    await report("llm", 0.05)
+    scripts = await prefetch(distinct)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    state = {"done": 0}
+
+    async def run(request, script):
+        async with semaphore:
+            try:
+                outcome = {"status": SUCCEEDED, "result": await run_item(request, script)}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Batch item '{request.topic}' failed: {e}")
+                outcome = {"status": FAILED, "error": str(getattr(e, "detail", e))}
+        state["done"] += 1
+        await report(f"{state['done']}/{len(distinct)} items", 0.1 + 0.9 * state["done"] / len(distinct))
+        return outcome
+
+    outcomes = await asyncio.gather(*(run(request, script) for request, script in zip(distinct, scripts)))
+    by_key = dict(zip(unique, outcomes))
+    items = [{"topic": request.topic, "grade": request.grade, **by_key[dedupe_key(request)]} for request in requests]
+    return {
+        "items": items,
+        "succeeded": sum(item["status"] == SUCCEEDED for item in items),
+        "failed": sum(item["status"] == FAILED for item in items),
+    }
@@ -0,0 +1,251 @@
+"""Local stand-ins for the OpenAI and Cloudinary APIs used by the benchmark.
+
+Chat completions answer a forced tool call with canned arguments for that
+schema: math scripts (the samples in ashok_testing/ by default), educational
+scenes, MCQs and titles, scene template parameters or code patches. Plain
+chat gets a short reply. Answers are streamed when asked. Images and speech
+return small generated media, and Cloudinary uploads are accepted and
+discarded. Every endpoint sleeps for a configurable latency first, so the app
+sees realistic round trips.
+
+Run from ai/:  python -m bench.fake_services --port 8100
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import re
+import tempfile
+import textwrap
+import time
+import uuid
+from pathlib import Path
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+from ffmpeg_tools import run_ffmpeg
+
+SAMPLES_DIR = Path(__file__).resolve().parents[2] / "ashok_testing"
+DEFAULT_SCRIPTS = [SAMPLES_DIR / "rotation.py", SAMPLES_DIR / "reflection.py"]
+
+# seconds, each endpoint adds up to BENCH_JITTER of random jitter
+LATENCY = {
+    "chat": float(os.getenv("BENCH_LATENCY_CHAT", "2.0")),
+    "image": float(os.getenv("BENCH_LATENCY_IMAGE", "3.0")),
+    "tts": float(os.getenv("BENCH_LATENCY_TTS", "1.0")),
+    "upload": float(os.getenv("BENCH_LATENCY_UPLOAD", "0.5")),
+}
+JITTER = float(os.getenv("BENCH_JITTER", "0.2"))
+TTS_SECONDS = float(os.getenv("BENCH_TTS_SECONDS", "3"))
+# give every math answer distinct code so renders are not all served by the render cache
+VARY_CODE = os.getenv("BENCH_VARY_CODE", "1") == "1"
+STREAM_CHUNK_CHARS = 40
+
+app = FastAPI()
+state = {"scripts": [], "media_dir": None}
+_variants = itertools.count()
+
+
+async def delay(kind: str):
+    await asyncio.sleep(LATENCY[kind] + random.uniform(0, JITTER))
+
+
+def make_media(media_dir: Path):
+    """One still image and one silent narration clip, generated once at startup."""
+    run_ffmpeg(["-f", "lavfi", "-i", "color=c=steelblue:s=1024x1024", "-frames:v", "1", str(media_dir / "image.png")])
+    run_ffmpeg(["-f", "lavfi", "-i", "anullsrc=r=24000:cl=mono", "-t", str(TTS_SECONDS),
+                "-c:a", "libmp3lame", "-b:a", "64k", str(media_dir / "speech.mp3")])
+
+
+def canned_math(prompt: str) -> dict:
+    code = random.choice(state["scripts"])
+    if VARY_CODE:
+        code += f"\n\nBENCH_VARIANT = {next(_variants)}\n"
+    return {
+        "manim_code": code,
+        "caption": "We rotate and reflect a triangle. Notice that its size and shape never change. Only its position does.",
+    }
+
+
+def canned_educational(prompt: str) -> dict:
+    return {
+        "scenes": [
+            ["A green leaf in sunlight", "Plants capture sunlight with their leaves. This light powers photosynthesis."],
+            ["Roots drinking water", "Roots pull water from the soil. Together with air, it becomes sugar for the plant."],
+        ],
+    }
+
+
+def canned_details(prompt: str) -> dict:
+    mcq = {"question": "Which gas do plants absorb?", "options": ["Oxygen", "Carbon dioxide", "Helium", "Neon"],
+           "correctAnswer": "Carbon dioxide"}
+    return {
+        "mcqs": [mcq] * 5,
+        "short_topic": "How plants make food",
+        "description": "Photosynthesis for young learners.",
+    }
+
+
+def canned_template(prompt: str) -> dict:
+    # every other template parameter has a default, a distinct title keeps renders out of the render cache
+    title = f"Benchmark {next(_variants)}" if VARY_CODE else "Benchmark"
+    return {
+        "use_template": True,
+        "params": {"title": title},
+        "caption": "Watch the shape move step by step. Its size and shape stay the same.",
+    }
+
+
+def canned_patch(prompt: str) -> dict:
+    """The function the patch prompt asks to fix, returned unchanged."""
+    match = re.search(r"The function to fix:\n(.*?)\n\s*Return only", prompt, re.S)
+    if not match:
+        return {"code": ""}
+    # the prompt indents the first line of the section, the def line, with its own text
+    first, _, body = match.group(1).strip("\n").partition("\n")
+    return {"code": first.strip() + "\n" + textwrap.indent(textwrap.dedent(body), "    ")}
+
+
+# forced tool name -> canned arguments
+TOOL_ANSWERS = {
+    "MathContent": canned_math,
+    "EducationalContent": canned_educational,
+    "VideoDetails": canned_details,
+    "TemplateContent": canned_template,
+    "CodePatch": canned_patch,
+}
+
+
+def answer_for(messages: list, tool: str = None) -> str:
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    if tool is not None:
+        if tool not in TOOL_ANSWERS:
+            raise ValueError(f"No canned answer for the {tool} tool")
+        return json.dumps(TOOL_ANSWERS[tool](prompt))
+    return "This is a canned benchmark reply. " * 8
+
+
+def usage(prompt: str, completion: str) -> dict:
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def forced_tool(body: dict):
+    """Name of the function the request forces the model to call, if any."""
+    choice = body.get("tool_choice")
+    if isinstance(choice, dict):
+        return choice.get("function", {}).get("name")
+    return None
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    tool = forced_tool(body)
+    content = answer_for(body["messages"], tool)
+    prompt = json.dumps(body["messages"])
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "gpt-4-turbo")
+    finish_reason = "tool_calls" if tool else "stop"
+    await delay("chat")
+    if not body.get("stream"):
+        message = {"role": "assistant", "content": content}
+        if tool:
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": tool, "arguments": content}}]}
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage(prompt, content),
+        }
+
+    def delta(start: int) -> dict:
+        piece = content[start:start + STREAM_CHUNK_CHARS]
+        if not tool:
+            return {"content": piece}
+        call = {"index": 0, "function": {"arguments": piece}}
+        if start == 0:
+            call.update(id=call_id, type="function")
+            call["function"]["name"] = tool
+        return {"tool_calls": [call]}
+
+    async def events():
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta(start), "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(0.01)
+        last = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+        yield f"data: {json.dumps(last)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            totals = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                      "choices": [], "usage": usage(prompt, content)}
+            yield f"data: {json.dumps(totals)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/images/generations")
+async def images(request: Request):
+    body = await request.json()
+    await delay("image")
+    n = body.get("n", 1)
+    if body.get("response_format") == "b64_json":
+        encoded = base64.b64encode((state["media_dir"] / "image.png").read_bytes()).decode()
+        data = [{"b64_json": encoded} for _ in range(n)]
+    else:
+        data = [{"url": f"{str(request.base_url).rstrip('/')}/files/image.png?i={i}"} for i in range(n)]
+    return {"created": int(time.time()), "data": data}
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    await request.body()
+    await delay("tts")
+    return FileResponse(state["media_dir"] / "speech.mp3", media_type="audio/mpeg")
+
+
+@app.post("/v1_1/{cloud_name}/{resource_type}/upload")
+async def cloudinary_upload(cloud_name: str, resource_type: str, request: Request):
+    # the multipart body is drained and dropped, only its transfer cost matters
+    size = len(await request.body())
+    await delay("upload")
+    public_id = uuid.uuid4().hex
+    url = f"{str(request.base_url).rstrip('/')}/files/uploads/{public_id}"
+    return JSONResponse({"public_id": public_id, "resource_type": resource_type, "bytes": size,
+                         "url": url, "secure_url": url})
+
+
+@app.get("/files/{name:path}")
+async def files(name: str):
+    if name.startswith("uploads/"):
+        return JSONResponse({"uploaded": name})
+    return FileResponse(state["media_dir"] / Path(name).name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--scripts", nargs="*", default=DEFAULT_SCRIPTS, type=Path,
+                        help="manim files replayed as the generated code")
+    args = parser.parse_args()
+
+    import uvicorn
+    state["scripts"] = [path.read_text() for path in args.scripts]
+    state["media_dir"] = Path(tempfile.mkdtemp(prefix="bench_media_"))
+    make_media(state["media_dir"])
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
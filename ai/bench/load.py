@@ -0,0 +1,204 @@
+"""Load driver: fires requests at a running app and reports how it coped.
+
+For every scenario it reports throughput and client-side latency percentiles,
+and, from the app's /metrics, per-stage latency percentiles and peak memory
+for the requests it sent. Results can be saved as JSON and compared with an
+earlier run, which fails when throughput or latency regressed.
+
+Run from ai/ against an app already pointed at bench.fake_services:
+    python -m bench.load --app http://127.0.0.1:8000 --scenario math chat -n 20 -c 4
+bench.run starts the fakes and the app for you.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+
+SCENARIOS = {
+    # two transformations at once fit no scene template, so the model writes the code
+    "math": ("/generate_math_video/", lambda i: {"topic": f"rotation and reflection of shapes, variant {i}", "grade": 6}),
+    "math_template": ("/generate_math_video/", lambda i: {"topic": f"rotation of a triangle (variant {i})", "grade": 6}),
+    "educational": ("/generate_educational_content/", lambda i: {"topic": f"photosynthesis, variant {i}", "grade": 5}),
+    "chat": ("/chat/", lambda i: {"message": f"Explain equivalent fractions with an example ({i})"}),
+}
+REQUEST_TIMEOUT = 900
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$")
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(values: list, q: float):
+    """Nearest-rank percentile of values, None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def parse_metrics(text: str) -> list:
+    """(name, labels, value) for every sample in a Prometheus text exposition."""
+    samples = []
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples.append((name, dict(_LABEL.findall(labels or "")), float(value)))
+    return samples
+
+
+def stage_buckets(samples: list) -> dict:
+    """stage -> {upper bound: cumulative count} of pipeline_stage_seconds."""
+    stages = {}
+    for name, labels, value in samples:
+        if name == "pipeline_stage_seconds_bucket":
+            bound = float("inf") if labels["le"] == "+Inf" else float(labels["le"])
+            buckets = stages.setdefault(labels["stage"], {})
+            # stages recorded under several label sets (e.g. quality) are merged
+            buckets[bound] = buckets.get(bound, 0) + value
+    return stages
+
+
+def histogram_percentile(buckets: dict, q: float):
+    """Percentile estimated from cumulative histogram buckets, interpolating inside a bucket."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if not total:
+        return None
+    rank = q / 100 * total
+    lower, below = 0.0, 0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(count - below, 1)
+        lower, below = bound, count
+    return lower
+
+
+async def scrape(client: httpx.AsyncClient, app: str) -> list:
+    response = await client.get(f"{app}/metrics")
+    response.raise_for_status()
+    return parse_metrics(response.text)
+
+
+async def run_scenario(client: httpx.AsyncClient, app: str, name: str, requests: int, concurrency: int) -> dict:
+    path, payload = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{app}{path}", json=payload(i), timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+    before = stage_buckets(await scrape(client, app))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - started
+    samples = await scrape(client, app)
+
+    stages = {}
+    for stage, buckets in stage_buckets(samples).items():
+        delta = {bound: count - before.get(stage, {}).get(bound, 0) for bound, count in buckets.items()}
+        if delta and max(delta.values()) > 0:
+            stages[stage] = {f"p{q}": histogram_percentile(delta, q) for q in (50, 90, 99)}
+    peak_rss = max([value for name, _, value in samples if name == "process_peak_rss_bytes"] or [0])
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "errors": errors[:5],
+        "wall_seconds": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "latency": {f"p{q}": percentile(latencies, q) for q in (50, 90, 99)},
+        "stages": stages,
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+async def run_load(app: str, scenarios: list, requests: int, concurrency: int) -> dict:
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency * 2)) as client:
+        return {name: await run_scenario(client, app, name, requests, concurrency) for name in scenarios}
+
+
+def format_seconds(value) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(results: dict):
+    for name, result in results.items():
+        latency = result["latency"]
+        print(f"\n== {name}: {result['succeeded']}/{result['requests']} ok at concurrency {result['concurrency']}, "
+              f"{result['throughput_rps']:.3f} req/s, peak RSS {result['peak_rss_bytes'] / 1024 ** 2:.0f} MiB")
+        print(f"   latency p50 {format_seconds(latency['p50'])}  p90 {format_seconds(latency['p90'])}  "
+              f"p99 {format_seconds(latency['p99'])}")
+        for stage, stats in sorted(result["stages"].items()):
+            print(f"   {stage:<22} p50 {format_seconds(stats['p50'])}  p90 {format_seconds(stats['p90'])}  "
+                  f"p99 {format_seconds(stats['p99'])}")
+        for error in result["errors"]:
+            print(f"   error: {error}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of throughput or p50/p90 latency beyond tolerance (a fraction) against baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_rps']:.3f} < {base['throughput_rps']:.3f} req/s")
+        for q in ("p50", "p90"):
+            now, before = result["latency"][q], base["latency"][q]
+            if now is not None and before is not None and now > before * (1 + tolerance):
+                regressions.append(f"{name}: latency {q} {now:.2f}s > {before:.2f}s")
+        if result["failed"] > base["failed"]:
+            regressions.append(f"{name}: {result['failed']} failures, baseline had {base['failed']}")
+    return regressions
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("-n", "--requests", type=int, default=10, help="requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+
+
+def report_and_compare(args, results: dict) -> int:
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="http://127.0.0.1:8000")
+    add_arguments(parser)
+    args = parser.parse_args()
+    results = asyncio.run(run_load(args.app.rstrip("/"), args.scenario, args.requests, args.concurrency))
+    sys.exit(report_and_compare(args, results))
+
+
+if __name__ == "__main__":
+    main()
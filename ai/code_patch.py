@@ -0,0 +1,71 @@
+"""Locate and replace the failing function of generated manim code.
+
+A failed render's traceback (or a validation error) names a line of the
+generated file. The innermost function around that line is the section the
+model is asked to fix, and its corrected definition is spliced back into the
+otherwise unchanged file. Animations before the broken one keep their partial
+movie hashes, so the next render only redraws from the patched part onwards.
+"""
+import ast
+import re
+import textwrap
+from dataclasses import dataclass
+
+
+@dataclass
+class Section:
+    name: str
+    # 1-based, inclusive, decorators included
+    start: int
+    end: int
+    indent: int
+    source: str
+
+
+def failing_line(error: str, filename: str = "manim_code.py"):
+    """Last line of filename mentioned in a traceback or validation error, or None."""
+    name = re.escape(filename)
+    # plain tracebacks, then manim's rich tracebacks ("manim_code.py:12 in construct")
+    for pattern in (rf'{name}", line (\d+)', rf"{name}:(\d+) in "):
+        matches = re.findall(pattern, error)
+        if matches:
+            return int(matches[-1])
+    match = re.search(r"\bon line (\d+)", error)
+    return int(match.group(1)) if match else None
+
+
+def locate_failure(code: str, error: str, filename: str = "manim_code.py"):
+    """The innermost function containing the failing line, or None if it can't be narrowed down."""
+    line = failing_line(error, filename)
+    if line is None:
+        return None
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    functions = [node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    enclosing = [node for node in functions if node.lineno <= line <= node.end_lineno]
+    # patching the only function is a full rewrite, leave that to the regular retry
+    if not enclosing or len(functions) < 2:
+        return None
+    node = min(enclosing, key=lambda node: node.end_lineno - node.lineno)
+    start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    lines = code.splitlines()
+    return Section(node.name, start, node.end_lineno, node.col_offset, "\n".join(lines[start - 1:node.end_lineno]))
+
+
+def splice(code: str, section: Section, replacement: str) -> str:
+    """Replace section with the new definition, re-indented to fit, and check the result parses."""
+    replacement = textwrap.dedent(replacement.strip("\n"))
+    try:
+        tree = ast.parse(replacement)
+    except SyntaxError as e:
+        raise ValueError(f"The patched {section.name} does not parse: {e.msg} on line {e.lineno}")
+    if len(tree.body) != 1 or getattr(tree.body[0], "name", None) != section.name:
+        raise ValueError(f"The patch must be a single definition of {section.name}")
+    lines = code.splitlines()
+    patched = lines[:section.start - 1] + textwrap.indent(replacement, " " * section.indent).splitlines() \
+        + lines[section.end:]
+    patched_code = "\n".join(patched) + "\n"
+    ast.parse(patched_code)
+    return patched_code
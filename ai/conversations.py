@@ -0,0 +1,50 @@
+"""Bounded server-side chat history for multi-turn /chat/ conversations.
+
+Each conversation keeps at most CHAT_HISTORY_MESSAGES recent messages, idle
+conversations expire after CHAT_CONVERSATION_TTL seconds and only the
+CHAT_MAX_CONVERSATIONS most recently used ones are kept, so memory stays flat.
+"""
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+
+CHAT_HISTORY_MESSAGES = int(os.getenv("CHAT_HISTORY_MESSAGES", "20"))
+CHAT_MAX_CONVERSATIONS = int(os.getenv("CHAT_MAX_CONVERSATIONS", "1000"))
+CHAT_CONVERSATION_TTL = float(os.getenv("CHAT_CONVERSATION_TTL", "3600"))
+
+
+class ConversationStore:
+    def __init__(self, max_messages=CHAT_HISTORY_MESSAGES, max_conversations=CHAT_MAX_CONVERSATIONS,
+                 ttl=CHAT_CONVERSATION_TTL):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        # conversation id -> (last used, deque of messages)
+        self._conversations = OrderedDict()
+
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._conversations:
+            conversation_id, (last_used, _) = next(iter(self._conversations.items()))
+            if last_used > cutoff:
+                break
+            del self._conversations[conversation_id]
+
+    def history(self, conversation_id: str) -> list:
+        """Messages of the conversation, oldest first."""
+        self._expire()
+        entry = self._conversations.get(conversation_id)
+        return list(entry[1]) if entry else []
+
+    def append(self, conversation_id: str, *messages):
+        self._expire()
+        entry = self._conversations.pop(conversation_id, None)
+        history = entry[1] if entry else deque(maxlen=self.max_messages)
+        history.extend(messages)
+        self._conversations[conversation_id] = (time.monotonic(), history)
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
@@ -0,0 +1,97 @@
+"""Pooled async downloads of generated media.
+
+All downloads share one httpx client, so connections to the image CDN are kept
+alive instead of paying a TCP/TLS handshake per file. At most
+DOWNLOAD_CONCURRENCY transfers run at once, bodies are streamed to a temporary
+file that is renamed into place when complete, and connection errors, timeouts,
+429 and 5xx answers are retried with exponential backoff. A download that still
+fails raises DownloadError instead of leaving a missing file behind.
+"""
+import asyncio
+import base64
+import os
+import random
+import uuid
+from pathlib import Path
+
+import httpx
+
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "16"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+class Downloader:
+    def __init__(self, concurrency=DOWNLOAD_CONCURRENCY, retries=DOWNLOAD_RETRIES, timeout=DOWNLOAD_TIMEOUT):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self._client = None
+        self._slots = None
+
+    def _ensure_client(self):
+        # created on first use so the client belongs to the running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def download(self, url: str, path) -> Path:
+        """Stream url to path, retrying transient failures."""
+        client = self._ensure_client()
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._slots:
+                    async with client.stream("GET", url) as response:
+                        if response.status_code == 429 or response.status_code >= 500:
+                            raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request,
+                                                        response=response)
+                        if response.status_code != 200:
+                            raise DownloadError(f"Download of {url} failed with HTTP {response.status_code}")
+                        with open(tmp_path, "wb") as f:
+                            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                                f.write(chunk)
+                os.replace(tmp_path, path)
+                return path
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                tmp_path.unlink(missing_ok=True)
+                if attempt == self.retries:
+                    raise DownloadError(f"Download of {url} failed after {attempt + 1} attempts: {e}")
+                delay = min(2 ** attempt, 10) * random.uniform(0.5, 1.5)
+                print(f"Download of {url} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+downloader = Downloader()
+
+
+async def download_file(url: str, path) -> Path:
+    return await downloader.download(url, path)
+
+
+def write_base64(data: str, path) -> Path:
+    """Decode a base64 payload from the API straight into path, no download needed."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+    tmp_path.write_bytes(base64.b64decode(data))
+    os.replace(tmp_path, path)
+    return path
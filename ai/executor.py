@@ -0,0 +1,27 @@
+"""Execution layer that keeps blocking work off the FastAPI event loop.
+
+Blocking network calls (OpenAI SDK, requests, Cloudinary) and waits on
+subprocesses such as ffmpeg and manim go to a shared thread pool via run_io.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O call in the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    # carry context variables such as the request id into the thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_pool, partial(context.run, fn, *args, **kwargs))
+
+
+def shutdown():
+    """Release pool workers, called when the app shuts down."""
+    io_pool.shutdown(wait=False, cancel_futures=True)
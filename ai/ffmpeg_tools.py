@@ -0,0 +1,62 @@
+"""Thin helpers around the ffmpeg binary."""
+import os
+import re
+import subprocess
+import tempfile
+
+
+def ffmpeg_binary() -> str:
+    """Prefer FFMPEG_BINARY, then the binary shipped with imageio-ffmpeg, then ffmpeg on PATH."""
+    if os.getenv("FFMPEG_BINARY"):
+        return os.getenv("FFMPEG_BINARY")
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return "ffmpeg"
+
+
+FFMPEG = ffmpeg_binary()
+
+
+def run_ffmpeg(args: list):
+    """Run ffmpeg with args, raising RuntimeError with its stderr on failure."""
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-loglevel", "error", "-y", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-2000:]}")
+
+
+def media_duration(path) -> float:
+    """Duration in seconds, read from ffmpeg's input probe (no ffprobe needed)."""
+    result = subprocess.run([FFMPEG, "-hide_banner", "-i", str(path)], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise RuntimeError(f"Could not read the duration of {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def write_concat_list(entries: list) -> str:
+    """Write an ffmpeg concat demuxer list of (path, duration or None) and return its path."""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        for path, duration in entries:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if duration is not None:
+                f.write(f"duration {duration:.6f}\n")
+        return f.name
+
+
+def concat_copy(inputs: list, output: str):
+    """Join media files that share codecs without re-encoding."""
+    list_path = write_concat_list([(path, None) for path in inputs])
+    try:
+        run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output])
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,177 @@
+"""Background sweeper for everything renders and requests leave on disk.
+
+Every JANITOR_INTERVAL seconds each Policy removes what under its root is
+older than its max_age and then, oldest first, whatever exceeds its
+max_bytes. Workspaces are normally removed by their own request, so the
+workspace policy only collects the ones a crashed or killed process left
+behind. Render and partial movie caches age out, while manim's Tex and text
+SVG caches are kept because every later render reuses them. Only untracked
+runtime directories are swept, never anything in the git checkout. Disk
+usage and free space are exported as gauges on /metrics.
+"""
+import asyncio
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from executor import run_io
+from metrics import inc, set_gauge
+from render_cache import RENDER_CACHE_DIR, RENDERS_DIR, PARTIALS_DIR, TEX_DIR, TEXTS_DIR
+from storage import STATIC_DIR
+from tts_cache import TTS_CACHE_DIR
+from workspace import WORKSPACE_ROOT, active_workspaces
+
+JANITOR_INTERVAL = float(os.getenv("JANITOR_INTERVAL", "600"))
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", str(6 * 3600)))
+RENDERS_MAX_AGE = float(os.getenv("RENDERS_MAX_AGE", str(7 * 24 * 3600)))
+PARTIALS_MAX_AGE = float(os.getenv("PARTIALS_MAX_AGE", str(24 * 3600)))
+PARTIALS_MAX_BYTES = int(os.getenv("PARTIALS_MAX_BYTES", str(2 * 1024 ** 3)))
+
+AI_DIR = Path(__file__).parent
+
+
+@dataclass
+class Policy:
+    name: str
+    root: Path
+    max_age: float = None
+    max_bytes: int = None
+    # entries are the files below root when True, else its top-level files and directories
+    per_file: bool = False
+
+
+def default_policies() -> list:
+    return [
+        Policy("workspaces", WORKSPACE_ROOT, max_age=WORKSPACE_MAX_AGE),
+        Policy("renders", RENDERS_DIR, max_age=RENDERS_MAX_AGE, per_file=True),
+        Policy("partial_movie_files", PARTIALS_DIR, max_age=PARTIALS_MAX_AGE, max_bytes=PARTIALS_MAX_BYTES,
+               per_file=True),
+    ]
+
+
+# directories only measured, never swept here (their owners bound them by size)
+MEASURED = {
+    "render_cache": RENDER_CACHE_DIR,
+    "tex_cache": TEX_DIR,
+    "text_cache": TEXTS_DIR,
+    "tts_cache": TTS_CACHE_DIR,
+    "static": STATIC_DIR,
+}
+
+
+def usage(path: Path):
+    """(bytes, files, newest mtime) of a file or everything below a directory."""
+    try:
+        stat = path.lstat()
+    except FileNotFoundError:
+        return 0, 0, 0.0
+    if not path.is_dir() or path.is_symlink():
+        return stat.st_size, 1, stat.st_mtime
+    total, files, newest = 0, 0, stat.st_mtime
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            files += 1
+            newest = max(newest, stat.st_mtime)
+    return total, files, newest
+
+
+def entries(policy: Policy) -> list:
+    """(newest mtime, bytes, path) of everything the policy may remove."""
+    if not policy.root.is_dir():
+        return []
+    if policy.per_file:
+        paths = (Path(dirpath) / filename for dirpath, _, filenames in os.walk(policy.root) for filename in filenames)
+    else:
+        paths = policy.root.iterdir()
+    found = []
+    for path in paths:
+        if path in active_workspaces:
+            continue
+        size, _, newest = usage(path)
+        found.append((newest, size, path))
+    return found
+
+
+def remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def sweep(policy: Policy, now: float = None) -> int:
+    """Apply policy once and return the number of bytes freed."""
+    now = time.time() if now is None else now
+    found = sorted(entries(policy), key=lambda entry: entry[0])
+    total = sum(size for _, size, _ in found)
+    freed = 0
+    for newest, size, path in found:
+        too_old = policy.max_age is not None and now - newest > policy.max_age
+        too_big = policy.max_bytes is not None and total > policy.max_bytes
+        if not (too_old or too_big):
+            # entries are oldest first, nothing newer is too old either
+            break
+        remove(path)
+        total -= size
+        freed += size
+        inc("janitor_removed_files_total", area=policy.name)
+    if freed:
+        inc("janitor_freed_bytes_total", freed, area=policy.name)
+        print(f"janitor: freed {freed} bytes from {policy.name}")
+    return freed
+
+
+def report_usage(policies: list):
+    areas = dict(MEASURED)
+    areas.update((policy.name, policy.root) for policy in policies)
+    for name, path in areas.items():
+        size, files, _ = usage(path)
+        set_gauge("disk_usage_bytes", size, area=name)
+        set_gauge("disk_usage_files", files, area=name)
+    disk = shutil.disk_usage(AI_DIR)
+    set_gauge("disk_free_bytes", disk.free)
+    set_gauge("disk_total_bytes", disk.total)
+
+
+def run_once(policies: list = None) -> int:
+    policies = default_policies() if policies is None else policies
+    freed = 0
+    for policy in policies:
+        try:
+            freed += sweep(policy)
+        except OSError as e:
+            print(f"janitor: sweeping {policy.name} failed: {e}")
+    report_usage(policies)
+    return freed
+
+
+class Janitor:
+    def __init__(self, interval=JANITOR_INTERVAL, policies: list = None):
+        self.interval = interval
+        self.policies = default_policies() if policies is None else policies
+        self._task = None
+
+    async def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await run_io(run_once, self.policies)
+            except Exception as e:
+                print(f"janitor: sweep failed: {e}")
+            await asyncio.sleep(self.interval)
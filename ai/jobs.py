@@ -0,0 +1,295 @@
+"""SQLite-backed job queue so clients poll for long running video generations.
+
+Submitting a job only inserts a row. A pool of worker tasks claims queued rows,
+runs the registered pipeline for the job kind and records per-stage progress,
+so throughput scales with JOB_WORKERS instead of open HTTP connections. Several
+uvicorn processes can share the same database file: a claimed job is leased to
+its process, which renews the lease while the job runs. Only jobs whose lease
+ran out, because their process died, are claimed again, and a job that was
+claimed JOB_MAX_ATTEMPTS times without finishing is failed instead of retried.
+A process that loses a lease stops running the job, and its late progress or
+result never overwrites that of the process that claimed the job next.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from executor import run_io
+from metrics import request_id_var
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobStore:
+    """Persists jobs in a single SQLite table."""
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    info TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "info" not in columns:
+                # databases created before partial results were reported
+                conn.execute("ALTER TABLE jobs ADD COLUMN info TEXT")
+            # databases created before jobs were leased
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "lease_until" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        # autocommit mode, transactions are opened explicitly where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, kind: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), QUEUED, now, now),
+            )
+        return job_id
+
+    def claim(self, owner: str, kinds=None, lease_seconds: float = JOB_LEASE_SECONDS,
+              max_attempts: int = JOB_MAX_ATTEMPTS):
+        """Atomically lease the oldest queued or abandoned job of one of kinds (any when None) to owner."""
+        if kinds is None:
+            kind_filter, kind_args = "", ()
+        else:
+            kind_filter, kind_args = f" AND kind IN ({', '.join('?' * len(kinds))})", tuple(kinds)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # abandoned jobs that already used up their attempts probably crash their process
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?" + kind_filter,
+                (FAILED, f"Abandoned after {max_attempts} attempts", now, RUNNING, now, max_attempts, *kind_args),
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE (status = ? OR (status = ? AND lease_until < ?))"
+                + kind_filter + " ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now, *kind_args),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = 0, owner = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, "starting", owner, now + lease_seconds, now, row[0]),
+            )
+            conn.execute("COMMIT")
+            return {"id": row[0], "kind": row[1], "payload": json.loads(row[2])}
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def update_progress(self, job_id: str, owner: str, stage: str, progress: float, info: dict = None) -> bool:
+        """Record the current stage; info, when given, is merged into the job's partial results.
+
+        Like finish and fail, this only touches a job still leased to owner and
+        returns False once another process has claimed it.
+        """
+        with self._connect() as conn:
+            if info:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT info FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                merged = {**(json.loads(row[0]) if row and row[0] else {}), **info}
+                cursor = conn.execute(
+                    "UPDATE jobs SET stage = ?, progress = ?, info = ?, updated_at = ? "
+                    "WHERE id = ? AND owner = ? AND status = ?",
+                    (stage, progress, json.dumps(merged), time.time(), job_id, owner, RUNNING),
+                )
+                conn.execute("COMMIT")
+            else:
+                cursor = conn.execute(
+                    "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                    (stage, progress, time.time(), job_id, owner, RUNNING),
+                )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, owner: str, result: dict) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = 1, result = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (SUCCEEDED, "done", json.dumps(result), time.time(), job_id, owner, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, owner: str, error: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (FAILED, error, time.time(), job_id, owner, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def renew_lease(self, job_id: str, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend owner's lease on a running job, False if the job is no longer owner's."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + lease_seconds, job_id, owner, RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, owner: str):
+        """Give a job interrupted by a shutdown back to the queue without counting the attempt."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = 0, owner = NULL, lease_until = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated_at = ? WHERE id = ? AND owner = ? AND status = ?",
+                (QUEUED, time.time(), job_id, owner, RUNNING),
+            )
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, stage, progress, result, error, info, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "stage": row[3],
+            "progress": row[4],
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+            "info": json.loads(row[7]) if row[7] else {},
+            "created_at": row[8],
+            "updated_at": row[9],
+        }
+
+
+class JobQueue:
+    """Runs queued jobs with a fixed number of worker tasks.
+
+    handlers maps a job kind to an async callable taking (payload, report)
+    and returning a JSON-serialisable result. Workers only claim jobs of
+    these kinds, so several queues can share one database. report(stage, progress, **info)
+    is an async callable the pipeline uses to publish progress and partial
+    results such as a playlist URL.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, workers=JOB_WORKERS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        # identifies this process' leases in a database shared by several processes
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lease")
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: dict) -> str:
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        return await run_io(self.store.submit, kind, payload)
+
+    async def get(self, job_id: str):
+        return await run_io(self.store.get, job_id)
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, n: int):
+        while True:
+            job = await run_io(self.store.claim, self.owner, list(self.handlers))
+            if job is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            await self._run(n, job)
+
+    async def _run(self, n: int, job: dict):
+        job_id = job["id"]
+        print(f"worker {n} running job {job_id} ({job['kind']})")
+        # stage metrics and logs of this job are tagged with the job id
+        request_id_var.set(job_id)
+
+        async def report(stage: str, progress: float, **info):
+            await run_io(self.store.update_progress, job_id, self.owner, stage, progress, info)
+
+        handler = asyncio.create_task(self.handlers[job["kind"]](job["payload"], report))
+        lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, handler, lost))
+        try:
+            result = await handler
+            if not await run_io(self.store.finish, job_id, self.owner, result):
+                print(f"job {job_id} finished after another process claimed it, its result is dropped")
+        except asyncio.CancelledError:
+            if lost.is_set() and not asyncio.current_task().cancelling():
+                # the heartbeat stopped the handler, the job now belongs to another process
+                return
+            # shutting down, another worker may pick the job up right away
+            await run_io(self.store.release, job_id, self.owner)
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            detail = getattr(e, "detail", None) or str(e)
+            await run_io(self.store.fail, job_id, self.owner, detail)
+        finally:
+            heartbeat.cancel()
+            handler.cancel()
+
+    async def _heartbeat(self, job_id: str, handler: asyncio.Task, lost: asyncio.Event):
+        """Renew the job's lease well before it runs out and stop the handler once the lease is lost.
+
+        Renewals run on the queue's own thread, so blocking pipeline calls queued
+        on the shared I/O pool never delay them past the lease.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            if not await loop.run_in_executor(self._lease_pool, self.store.renew_lease, job_id, self.owner):
+                print(f"lost the lease on job {job_id}, stopping it, another process may run it again")
+                lost.set()
+                handler.cancel()
+                return
@@ -0,0 +1,182 @@
+"""Quality ladder for manim renders.
+
+Math videos are first rendered at 480p15 and returned right away. The same code
+is then re-rendered at each quality in RENDER_LADDER, reusing the shared
+Tex/SVG and partial movie caches, and every finished rendition is recorded so
+clients can switch to the best one available. Upgrades are jobs in the
+persistent job queue, run by their own UPGRADE_CONCURRENCY workers, so they
+survive restarts and never take a worker from a preview. Renditions still
+pending once their job has failed are marked failed on startup and on lookup.
+"""
+import asyncio
+import os
+import shutil
+import sqlite3
+import time
+
+from assembly import add_audio_to_video
+from executor import run_io
+from jobs import FAILED, SUCCEEDED, JobQueue, JobStore
+from metrics import stage
+from render_cache import QUALITY_DIRS
+from storage import upload_file
+from utils import run_manim, text_to_speech
+from workspace import workspace
+
+# manim quality flags rendered after the preview, lowest first
+RENDER_LADDER = [q for q in os.getenv("RENDER_LADDER", "m,h").split(",") if q]
+PREVIEW_QUALITY = "l"
+# background upgrades are throttled so they never starve preview renders
+UPGRADE_CONCURRENCY = int(os.getenv("UPGRADE_CONCURRENCY", "1"))
+RENDITIONS_DB_PATH = os.getenv("RENDITIONS_DB_PATH", "renditions.db")
+UPGRADE_JOB = "quality_upgrade"
+
+
+class RenditionStore:
+    """Published renditions of every video, keyed by video id and quality."""
+
+    def __init__(self, path=RENDITIONS_DB_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS renditions (
+                    video_id TEXT NOT NULL,
+                    quality TEXT NOT NULL,
+                    resolution TEXT NOT NULL,
+                    url TEXT,
+                    status TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, quality)
+                )"""
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(renditions)")]
+            if "job_id" not in columns:
+                # databases created before upgrades were queued as jobs
+                conn.execute("ALTER TABLE renditions ADD COLUMN job_id TEXT")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def set(self, video_id: str, quality: str, status: str, url: str = None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO renditions (video_id, quality, resolution, url, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, quality, QUALITY_DIRS[quality], url, status, time.time()),
+            )
+
+    def add_pending(self, video_id: str, qualities, job_id: str):
+        """Record qualities as pending on job_id, keeping any the job already finished."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO renditions (video_id, quality, resolution, status, job_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(video_id, quality, QUALITY_DIRS[quality], "pending", job_id, now) for quality in qualities],
+            )
+
+    def pending_jobs(self, video_id: str = None) -> list:
+        """(video_id, job_id) of every video, or just video_id, with pending renditions."""
+        query = "SELECT DISTINCT video_id, job_id FROM renditions WHERE status = 'pending'"
+        with self._connect() as conn:
+            if video_id is None:
+                return conn.execute(query).fetchall()
+            return conn.execute(query + " AND video_id = ?", (video_id,)).fetchall()
+
+    def fail_pending(self, video_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE renditions SET status = 'failed', updated_at = ? WHERE video_id = ? AND status = 'pending'",
+                (time.time(), video_id),
+            )
+
+    def get(self, video_id: str):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT quality, resolution, url, status FROM renditions WHERE video_id = ?", (video_id,)
+            ).fetchall()
+        if not rows:
+            return None
+        order = list(QUALITY_DIRS)
+        rows.sort(key=lambda row: order.index(row[0]))
+        ready = {resolution: url for _, resolution, url, status in rows if status == "ready"}
+        return {
+            "video_id": video_id,
+            "renditions": ready,
+            "pending": [resolution for _, resolution, _, status in rows if status == "pending"],
+            "failed": [resolution for _, resolution, _, status in rows if status == "failed"],
+            # the highest quality that is ready, this is what players should switch to
+            "best": ready[list(ready)[-1]] if ready else None,
+        }
+
+
+class QualityLadder:
+    def __init__(self, store: RenditionStore, jobs: JobStore, qualities=RENDER_LADDER,
+                 concurrency=UPGRADE_CONCURRENCY):
+        self.store = store
+        self.qualities = qualities
+        self.queue = JobQueue(jobs, {UPGRADE_JOB: self._upgrade}, workers=concurrency)
+
+    async def start(self):
+        await run_io(self.expire_pending)
+        await self.queue.start()
+
+    async def stop(self):
+        await self.queue.stop()
+
+    async def publish(self, video_id: str, url: str, code: str, caption: str):
+        """Publish the preview and queue the higher qualities.
+
+        The narration is synthesized again from the caption when the job runs,
+        which the TTS cache answers without calling the API.
+        """
+        await run_io(self.store.set, video_id, PREVIEW_QUALITY, "ready", url)
+        if not self.qualities:
+            return
+        job_id = await self.queue.submit(UPGRADE_JOB, {"video_id": video_id, "code": code, "caption": caption})
+        await run_io(self.store.add_pending, video_id, self.qualities, job_id)
+
+    def expire_pending(self, video_id: str = None):
+        """Fail renditions left pending by an upgrade job that is gone or no longer running."""
+        for pending_video_id, job_id in self.store.pending_jobs(video_id):
+            job = self.queue.store.get(job_id) if job_id else None
+            if job is None or job["status"] in (FAILED, SUCCEEDED):
+                print(f"Upgrades of {pending_video_id} were abandoned")
+                self.store.fail_pending(pending_video_id)
+
+    async def status(self, video_id: str):
+        await run_io(self.expire_pending, video_id)
+        return await run_io(self.store.get, video_id)
+
+    async def _upgrade(self, payload: dict, report):
+        video_id = payload["video_id"]
+        current = await run_io(self.store.get, video_id)
+        # a job run again after a restart skips the qualities it already published
+        todo = [q for q in self.qualities if current is None or QUALITY_DIRS[q] not in current["renditions"]]
+        async with workspace("upgrade") as workdir:
+            code_path = workdir / "manim_code.py"
+            code_path.write_text(payload["code"])
+            audio_path = workdir / "narration.mp3"
+            with stage("tts"):
+                await run_io(text_to_speech, payload["caption"], str(audio_path))
+            for n, quality in enumerate(todo):
+                await report(QUALITY_DIRS[quality], n / len(todo))
+                try:
+                    with stage("manim_render_upgrade", quality=quality):
+                        video_path = await run_manim(code_path, f"{video_id}_{quality}.mp4", workdir / "media",
+                                                     quality, validate_code=False)
+                    final_path = workdir / f"{video_id}_{QUALITY_DIRS[quality]}.mp4"
+                    with stage("encode"):
+                        await run_io(add_audio_to_video, str(video_path), str(audio_path), str(final_path))
+                    with stage("upload"):
+                        url = await run_io(upload_file, final_path, "video")
+                    await run_io(self.store.set, video_id, quality, "ready", url)
+                    print(f"Upgraded {video_id} to {QUALITY_DIRS[quality]}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Upgrade of {video_id} to {QUALITY_DIRS[quality]} failed: {e}")
+                    await run_io(self.store.set, video_id, quality, "failed")
+                finally:
+                    # keep scratch space bounded between rungs
+                    shutil.rmtree(workdir / "media", ignore_errors=True)
+        return await run_io(self.store.get, video_id)
@@ -0,0 +1,105 @@
+"""In-process cache for LLM responses.
+
+Entries are keyed on the normalized prompt, so a repeated request skips both the
+model round trip and output parsing. With LLM_CACHE_SEMANTIC enabled, a miss
+falls back to comparing the embedding of the topic against cached topics of the
+same kind and scope (e.g. grade) and reuses the closest one above
+LLM_CACHE_SIMILARITY. Entries expire after LLM_CACHE_TTL seconds and the least
+recently used entry is dropped once LLM_CACHE_MAX_ENTRIES is reached.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_SEMANTIC = os.getenv("LLM_CACHE_SEMANTIC", "0") == "1"
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.93"))
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class CacheEntry:
+    def __init__(self, value, expires_at, kind, scope, vector):
+        self.value = value
+        self.expires_at = expires_at
+        self.kind = kind
+        self.scope = scope
+        self.vector = vector
+
+
+class LLMCache:
+    def __init__(self, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES, embeddings=None,
+                 similarity=LLM_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # any object with a langchain style aembed_query, None disables near-duplicate matching
+        self.embeddings = embeddings
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, kind, prompt, scope):
+        raw = f"{kind}\0{scope}\0{normalize_text(prompt)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def _embed(self, topic):
+        if self.embeddings is None or not topic:
+            return None
+        vector = np.asarray(await self.embeddings.aembed_query(normalize_text(topic)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+            del self._entries[key]
+
+    async def get(self, kind: str, prompt: str, topic: str = None, scope=None):
+        """Return the cached value for the prompt, or a near-duplicate topic, or None."""
+        self._expire()
+        key = self._key(kind, prompt, scope)
+        if key not in self._entries and self.embeddings is not None:
+            key = await self._nearest(kind, topic, scope)
+        if key is None or key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key].value
+
+    async def _nearest(self, kind, topic, scope):
+        """Key of the most similar cached topic of the same kind and scope, if close enough."""
+        candidates = [(key, entry) for key, entry in self._entries.items()
+                      if entry.kind == kind and entry.scope == scope and entry.vector is not None]
+        if not candidates:
+            return None
+        query = await self._embed(topic)
+        if query is None:
+            return None
+        scores = np.stack([entry.vector for _, entry in candidates]) @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        print(f"LLM cache near-duplicate hit for '{topic}' (similarity {scores[best]:.3f})")
+        return candidates[best][0]
+
+    async def put(self, kind: str, prompt: str, value, topic: str = None, scope=None):
+        vector = await self._embed(topic)
+        key = self._key(kind, prompt, scope)
+        self._entries[key] = CacheEntry(value, time.monotonic() + self.ttl, kind, scope, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, value):
+        """Drop every entry holding value, e.g. generated code that turned out not to render."""
+        for key in [key for key, entry in self._entries.items() if entry.value is value]:
+            del self._entries[key]
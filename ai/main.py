@@ -1,26 +1,51 @@
+import asyncio
 import os
 import json
 import subprocess
 import re
-from fastapi import FastAPI, HTTPException
+import time
+import uuid
+from pathlib import Path
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 import cloudinary
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 import cloudinary.uploader
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage
-from typing import List, Tuple
-from langchain.output_parsers import PydanticOutputParser
+from fastapi.staticfiles import StaticFiles
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.schema import HumanMessage, AIMessage
+from typing import List, Optional, Tuple
 from langchain.prompts import ChatPromptTemplate
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
 from typing import List
 
-from utils import run_manim, generate_safe_filename, generate_image, text_to_speech, save_image, add_audio_to_video
+from executor import run_io, shutdown as shutdown_executor
+from workspace import workspace, DiskQuotaExceeded
+from metrics import stage, record_tokens, observe, log_event, render_metrics, request_id_var
+from conversations import ConversationStore
+from llm_cache import LLMCache, LLM_CACHE_SEMANTIC
+from jobs import JobQueue, JobStore, QUEUED, SUCCEEDED, FAILED
+from utils import run_manim, generate_safe_filename, generate_single_scene, text_to_speech, SpeechError, MAX_CONCURRENCY
+from assembly import assemble_video, add_audio_to_video, join_segments
+from progressive import SceneDelivery
+from storage import upload_file, upload_files, STATIC_DIR
+from thumbnails import make_thumbnails, POSTER_FORMATS
+from ladder import QualityLadder, RenditionStore
+from manim_runner import render_pool, MANIM_WARM_POOL
+from downloader import downloader
+from janitor import Janitor
+from code_patch import locate_failure, splice
+from scene_templates import match_template
+from structured_output import stream_structured, bind_schema, parse_tool_call
+from batch import run_batch, BATCH_MAX_ITEMS, BATCH_LLM_CONCURRENCY
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# smaller model for the MCQs, title and description of a video
+DETAILS_MODEL = os.getenv("DETAILS_MODEL", "gpt-4o-mini")
 cloudinary.config(
     cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
     api_key=os.getenv('CLOUDINARY_API_KEY'),
@@ -28,20 +53,60 @@ cloudinary.config(
 )
 
 
-async def upload_to_cloudinary(file_path, resource_type):
+app = FastAPI()
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    """Tag everything a request does with a request id and time the request."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    status_code = 500
     try:
-        result = cloudinary.uploader.upload(file_path, resource_type=resource_type)
-        return result['secure_url']
-    except Exception as e:
-        print(f"Error uploading to Cloudinary: {str(e)}")
-        raise
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["x-request-id"] = request_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        # label by route template so /jobs/{job_id} doesn't create a series per job,
+        # and never by a raw path, which anyone can vary
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        observe("http_request_seconds", elapsed, path=path, status=status_code)
+        log_event("request", method=request.method, path=request.url.path, status=status_code,
+                  wall_s=round(elapsed, 3))
+        request_id_var.reset(token)
 
 
-app = FastAPI()
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.exception_handler(DiskQuotaExceeded)
+async def disk_quota_exceeded_handler(request, exc: DiskQuotaExceeded):
+    return JSONResponse(status_code=503, content={"detail": f"Server is out of scratch space: {exc}"})
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await job_queue.stop()
+    await quality_ladder.stop()
+    await render_pool.close()
+    await downloader.close()
+    await janitor.stop()
+    shutdown_executor()
+
 
 
 
 
+# files published by the local storage backend
+STATIC_DIR.mkdir(parents=True, exist_ok=True)
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,9 +119,39 @@ app.add_middleware(
 
 chate = ChatOpenAI(
     model_name="gpt-4-turbo",
-    openai_api_key=OPENAI_API_KEY
+    openai_api_key=OPENAI_API_KEY,
+    # report token usage for streamed answers too
+    stream_usage=True
+)
+
+chat_details = ChatOpenAI(
+    model_name=DETAILS_MODEL,
+    openai_api_key=OPENAI_API_KEY,
+    stream_usage=True
+)
+
+async def invoke_llm(messages):
+    """Call the chat model, recording its latency and token usage."""
+    with stage("llm_call"):
+        response = await chate.ainvoke(messages)
+    record_tokens(chate.model_name, response)
+    return response
+
+
+async def invoke_structured(messages, schema, on_field=None, llm=chate):
+    """Call the chat model for an answer shaped like schema, streaming its fields to on_field."""
+    with stage("llm_call"):
+        result, message = await stream_structured(llm, messages, schema, on_field)
+    record_tokens(llm.model_name, message)
+    return result
+
+
+llm_cache = LLMCache(
+    embeddings=OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY) if LLM_CACHE_SEMANTIC else None
 )
 
+conversations = ConversationStore()
+
 class MCQ(BaseModel):
     question: str
     options: List[str]
@@ -64,6 +159,8 @@ class MCQ(BaseModel):
 
 class EducationalContent(BaseModel):
     scenes: List[Tuple[str, str]] = Field(description="List of tuples containing scene descriptions and narration scripts")
+
+class VideoDetails(BaseModel):
     mcqs: List[MCQ] = Field(description="List of 5 multiple-choice questions")
     short_topic: str = Field(description="A catchy title for the video")
     description:str = Field(description="short description summarizing the content of video")
@@ -73,105 +170,225 @@ class ContentRequest(BaseModel):
     grade: int
 
 
+details_prompt = ChatPromptTemplate.from_template(
+    """You are an AI system writing the quiz for an educational video for students of grade {grade}.
+        Provide 5 multiple-choice questions (MCQs) related to the topic and a short catchy video title and desc.
+
+        The topic is: {topic}
+        """
+)
+
+
+async def generate_video_details(request: ContentRequest) -> VideoDetails:
+    """MCQs, title and description of a video, from the smaller model.
+
+    They only depend on the topic and grade, so they are generated alongside
+    the script or code and shared by every video on the same topic.
+    """
+    prompt = details_prompt.format_prompt(grade=request.grade, topic=request.topic)
+    details = await llm_cache.get("details", prompt.to_string(), topic=request.topic, scope=request.grade)
+    if details is None:
+        details = await invoke_structured(prompt.to_messages(), VideoDetails, llm=chat_details)
+        await llm_cache.put("details", prompt.to_string(), details, topic=request.topic, scope=request.grade)
+    return details
+
+
+async def cancel_task(task):
+    """Cancel task unless it is done and wait for it, swallowing its error."""
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def publish_thumbnails(video_path, workdir: Path) -> dict:
+    """Cut posters and a sprite sheet from video_path and upload them.
+
+    Returns the "thumbnail", "posters" and "sprite" fields of a response. A
+    failure here only costs the thumbnails, never the video.
+    """
+    try:
+        with stage("thumbnail"):
+            thumbnails = await run_io(make_thumbnails, video_path, workdir / "thumbnails")
+        posters, sprite = thumbnails["posters"], thumbnails["sprite"]
+        with stage("upload"):
+            urls = await upload_files(*[(path, "image") for _, _, path in posters], (sprite["path"], "image"))
+        posters = [{"width": width, "format": fmt, "url": url} for (width, fmt, _), url in zip(posters, urls)]
+        sprite = {key: value for key, value in sprite.items() if key != "path"}
+        sprite["url"] = urls[-1]
+        # the largest poster in the preferred format stands in for the old single thumbnail
+        thumbnail = max((p for p in posters if p["format"] == POSTER_FORMATS[0]), key=lambda p: p["width"])
+    except Exception as e:
+        print(f"Could not create thumbnails for {video_path}: {e}")
+        return {"thumbnail": "", "posters": [], "sprite": None}
+    return {"thumbnail": thumbnail["url"], "posters": posters, "sprite": sprite}
+
+
+
+
+async def no_progress(stage: str, progress: float, **info):
+    """Progress reporter used when a pipeline runs inside a plain HTTP request."""
 
 
 @app.post("/generate_educational_content/")
 async def generate_educational_content(request: ContentRequest):
-    prompt_template = ChatPromptTemplate.from_template(
-        """You are an AI system for generating educational video content for students. please generate only 2 scenes.
-        Additionally, provide 5 multiple-choice questions (MCQs) related to the topic and short catchy video title and desc
+    return await educational_content_pipeline(request)
+
+
+async def educational_content_pipeline(request: ContentRequest, report=no_progress, script=None):
+    async with workspace("educational") as workdir:
+        return await build_educational_content(request, workdir, report, script)
+
+
+educational_prompt = ChatPromptTemplate.from_template(
+    """You are an AI system for generating educational video content for students. please generate only 2 scenes.
 
         The topic is: {topic}
 
-        {format_instructions}
         If the topic in not related to the education, leave each field empty.
         """
+)
+
+
+async def generate_educational_script(request: ContentRequest, script=None, on_scene=None):
+    """Ask the model for the scenes of an educational video.
+
+    script is an answer already fetched for this request, e.g. by a batch.
+    on_scene(index, scene) is called for every scene as soon as it has
+    streamed in; scenes of a cached or prefetched answer are not reported.
+    """
+    # Step 1: Format the prompt with user's input, the output schema goes along as a tool
+    prompt = educational_prompt.format_prompt(
+        grade=request.grade,
+        topic=request.topic,
     )
-    parser = PydanticOutputParser(pydantic_object=EducationalContent)
 
+    async def on_field(key, index, value):
+        if key == "scenes" and index is not None and on_scene is not None:
+            on_scene(index, tuple(value))
 
-    try:
-        # Step 1: Format the prompt with user's input and desired output format
-        prompt = prompt_template.format_prompt(
-            grade=request.grade,
-            topic=request.topic,
-            format_instructions=parser.get_format_instructions()
-        )
+    # Step 2: Get the response from the language model, unless the same topic was answered recently
+    parsed_response = script
+    if parsed_response is None:
+        parsed_response = await llm_cache.get("educational", prompt.to_string(), topic=request.topic, scope=request.grade)
+    if parsed_response is None:
+        # Step 3: the answer is parsed while it streams
+        parsed_response = await invoke_structured(prompt.to_messages(), EducationalContent, on_field)
+        if parsed_response.scenes:
+            await llm_cache.put("educational", prompt.to_string(), parsed_response, topic=request.topic, scope=request.grade)
+    if not parsed_response.scenes:
+        raise HTTPException(status_code=400, detail="The title field is empty. Please provide a relevant topic.")
+    return parsed_response
 
-        # Step 2: Get the response from the language model
-        response = chate.invoke(prompt.to_messages())
-        print("chate response ", response)
-        # Step 3: Parse the response
-        parsed_response = parser.parse(response.content)
-        if not parsed_response.scenes:
-            raise HTTPException(status_code=400, detail="The title field is empty. Please provide a relevant topic.")
-            
-        # Step 4: Generate images using DALL-E for each scene description
-        image_files = []
-        for i, scene_description in enumerate(parsed_response.scenes):
-            files = generate_image(scene_description[0], i)  # Call DALL-E or similar
-            image_files.extend(files)
-
-        # Step 5: Convert narration scripts to audio using a Text-to-Speech engine
-        audio_files = []
-        caption = ""
-        for i, narration_script in enumerate(parsed_response.scenes):
-            filename = f"temp_audio_{i}.mp3"
-            text_to_speech(narration_script[1], filename)  # Convert narration to speech
-            audio_files.append(filename)
-            caption += narration_script[1]
-
-        # Step 6: Assemble the video using MoviePy
-        def assemble_video(scene_images: List[str], audio_files: List[str], output_filename: str = "educational_video.mp4"):
-            clips = []
-            for audio_index, audio_file in enumerate(audio_files):
-                audio_clip = AudioFileClip(audio_file)
-                image_duration = audio_clip.duration / len(scene_images[audio_index * 5:(audio_index + 1) * 5])
-                
-                for img_index in range(audio_index * 5, (audio_index + 1) * 5):
-                    image_clip = ImageClip(scene_images[img_index]).set_duration(image_duration)
-                    start_time = (img_index % 5) * image_duration
-                    image_clip = image_clip.set_audio(audio_clip.subclip(start_time, start_time + image_duration))
-                    clips.append(image_clip)
-                    
-            final_video = concatenate_videoclips(clips, method="compose")
-            final_video.write_videofile(output_filename, fps=1)
 
-        # Call the video assembly function
-        video_filename = "educational_video.mp4"
-        assemble_video(image_files, audio_files, video_filename)
+async def generate_script_and_start_scenes(request: ContentRequest, start_scene, script=None):
+    """Get the educational script, calling start_scene(index, scene) for every scene as early as possible."""
+    started = set()
+
+    def on_scene(index, scene):
+        started.add(index)
+        start_scene(index, scene)
+
+    parsed_response = await generate_educational_script(request, script, on_scene)
+    # scenes that were never streamed, e.g. all of a cached answer, start now; started ones are not restarted
+    for index, scene in enumerate(parsed_response.scenes):
+        if index not in started:
+            start_scene(index, scene)
+    return parsed_response
 
-        
 
-        upload_result = cloudinary.uploader.upload_large(video_filename, resource_type="video")
-        video_url = upload_result['secure_url']
+async def build_educational_content(request: ContentRequest, workdir: Path, report=no_progress, script=None):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    scene_tasks = {}
+    details_task = asyncio.create_task(generate_video_details(request))
 
-        # Step 8: Upload thumbnail (using first image as thumbnail)
-        thumbnail = cloudinary.uploader.upload(image_files[0])
+    def start_scene(index, scene):
+        scene_tasks[index] = asyncio.create_task(generate_single_scene(index, scene, workdir, semaphore))
 
-        # Clean up temp files (optional)
-        for file in image_files + audio_files:
-            os.remove(file)
-        os.remove(video_filename)
+    try:
+        # Step 4 & 5: Generate images using DALL-E and convert narration scripts to audio.
+        # Each scene starts as soon as it has streamed in.
+        await report("llm", 0.05)
+        parsed_response = await generate_script_and_start_scenes(request, start_scene, script)
+        await report("assets", 0.2)
+        results = await asyncio.gather(*(scene_tasks[i] for i in range(len(parsed_response.scenes))))
+        image_files = [f for files, _ in results for f in files]
+        audio_files = [audio for _, audio in results]
+        caption = "".join(narration_script[1] for narration_script in parsed_response.scenes)
+
+        # Step 6: Assemble the video with ffmpeg
+        await report("encode", 0.6)
+        video_filename = str(workdir / "educational_video.mp4")
+        with stage("encode"):
+            await run_io(assemble_video, image_files, audio_files, video_filename)
+
+        # Step 7 & 8: Upload the video while posters are cut from it and uploaded
+        await report("upload", 0.85)
+        with stage("upload"):
+            video_url, thumbnails = await asyncio.gather(
+                run_io(upload_file, video_filename, "video"), publish_thumbnails(video_filename, workdir)
+            )
 
         # Step 9: Return the result, including the video link, thumbnail, and MCQs
+        details = await details_task
         return {
-            "video_title": parsed_response.short_topic,
+            "video_title": details.short_topic,
             "caption": caption,
-            "description": request.topic,
-            "thumbnail": thumbnail["secure_url"],
+            "description": details.description,
+            **thumbnails,
             "video_link": video_url,
-            "mcqs": parsed_response.mcqs
+            "mcqs": details.mcqs
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # scenes still running after a failure would write into a workspace that is being removed
+        await asyncio.gather(*(cancel_task(task) for task in [details_task, *scene_tasks.values()]))
+
 
 
 
+async def progressive_educational_pipeline(request: ContentRequest, report=no_progress):
+    """Publish each scene to an HLS playlist as soon as it is ready, then the full MP4."""
+    async with workspace("progressive") as workdir:
+        # scenes are rendered and published while the rest of the script streams in
+        delivery = SceneDelivery(workdir, workdir.name, report)
+        details_task = asyncio.create_task(generate_video_details(request))
+        try:
+            await report("llm", 0.05)
+            parsed_response = await generate_script_and_start_scenes(request, delivery.start)
+            await report("scenes", 0.2)
+            segments, manifest_url = await delivery.finish(len(parsed_response.scenes))
+            details = await details_task
+        except BaseException:
+            await asyncio.gather(delivery.cancel(), cancel_task(details_task))
+            raise
+        caption = "".join(narration_script[1] for narration_script in parsed_response.scenes)
+
+        # the segments are already encoded, joining them is a remux
+        await report("upload", 0.85, manifest_url=manifest_url)
+        video_filename = str(workdir / "educational_video.mp4")
+        with stage("encode"):
+            await run_io(join_segments, segments, video_filename)
+        with stage("upload"):
+            video_url, thumbnails = await asyncio.gather(
+                run_io(upload_file, video_filename, "video"), publish_thumbnails(video_filename, workdir)
+            )
+
+        return {
+            "video_title": details.short_topic,
+            "caption": caption,
+            "description": details.description,
+            **thumbnails,
+            "video_link": video_url,
+            "manifest_url": manifest_url,
+            "mcqs": details.mcqs
+        }
+
 
 class ChatInput(BaseModel):
     message: str
+    # pass the id returned by a previous reply to continue that conversation
+    conversation_id: Optional[str] = None
 
 @app.post("/chat/")
 async def chat_with_gpt(input: ChatInput):
@@ -179,21 +396,68 @@ async def chat_with_gpt(input: ChatInput):
         # Create a message with the user's input
         message = HumanMessage(content=input.message)
 
+        # a message without an id starts a new conversation
+        conversation_id = input.conversation_id or conversations.new_id()
+        if input.conversation_id is None:
+            cached = await llm_cache.get("chat", input.message)
+            if cached is not None:
+                conversations.append(conversation_id, message, AIMessage(content=cached))
+                return {"response": cached, "conversation_id": conversation_id}
+
         # Get the response from the language model
-        response = chate.invoke([message])
+        history = conversations.history(input.conversation_id) if input.conversation_id else []
+        response = await invoke_llm(history + [message])
+        if input.conversation_id is None:
+            await llm_cache.put("chat", input.message, response.content)
+        conversations.append(conversation_id, message, AIMessage(content=response.content))
 
         # Return the response content
-        return {"response": response.content}
+        return {"response": response.content, "conversation_id": conversation_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream/")
+async def stream_chat_with_gpt(input: ChatInput):
+    """Stream the reply as Server-Sent Events as soon as the model produces tokens."""
+    conversation_id = input.conversation_id or conversations.new_id()
+    message = HumanMessage(content=input.message)
+    history = conversations.history(conversation_id)
+
+    async def events():
+        yield sse_event({"conversation_id": conversation_id}, event="start")
+        # the chunks add up to the whole reply, the last one carries the token usage
+        reply = None
+        try:
+            with stage("llm_stream"):
+                async for chunk in chate.astream(history + [message]):
+                    reply = chunk if reply is None else reply + chunk
+                    if chunk.content:
+                        yield sse_event({"token": chunk.content})
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+        finally:
+            if reply is not None:
+                record_tokens(chate.model_name, reply)
+        conversations.append(conversation_id, message, AIMessage(content=reply.content if reply is not None else ""))
+        yield sse_event({"conversation_id": conversation_id}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "x-conversation-id": conversation_id},
+    )
+
+
 class MathContent(BaseModel):
     manim_code: str = Field(description="manim script in python to generate the video according to the user's query. make the video at least 20 seconds long or more")
     caption:str = Field(description="Narration script to narrate the texts in video and the video itself in one sentence")
-    mcqs: List[MCQ] = Field(description="List of 5 multiple-choice questions")
-    short_topic: str = Field(description="A catchy title for the video")
-    description:str = Field(description="short description summarizing the content of video")
     # thumbnail:str = Field(description="link to an image that can act like thubnail for this video")
 
 
@@ -201,94 +465,447 @@ class MathContent(BaseModel):
 MAX_RETRIES = 3
 
 
+def escape_braces(text: str) -> str:
+    """Escape text so ChatPromptTemplate doesn't treat code or tracebacks as variables."""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class CodePatch(BaseModel):
+    code: str = Field(description="The complete corrected definition of the function, including its def line and decorators, and nothing else")
+
+
+async def patch_failing_section(previous: MathContent, error_message: str):
+    """Ask the model to fix only the function the error points at.
+
+    Returns the previous response with the patched code, or None when the
+    failure can't be narrowed to one function or the patch doesn't fit, in
+    which case the caller asks for a whole new file.
+    """
+    section = locate_failure(previous.manim_code, error_message)
+    if section is None:
+        return None
+    prompt_template = ChatPromptTemplate.from_template(
+        """You are fixing Manim code that failed to render. Only the function `{name}` needs to change.
+
+        The error was:
+        {error}
+
+        The whole file, for context:
+        {code}
+
+        The function to fix:
+        {section}
+
+        Return only the corrected definition of `{name}` with the same name and signature. Keep everything that is not broken as it is."""
+    )
+    prompt = prompt_template.format_prompt(
+        name=section.name,
+        error=error_message,
+        code=previous.manim_code,
+        section=section.source,
+    )
+    try:
+        patch = await invoke_structured(prompt.to_messages(), CodePatch)
+        patched_code = splice(previous.manim_code, section, patch.code)
+    except Exception as e:
+        print(f"Could not patch {section.name}, regenerating the whole file: {e}")
+        return None
+    print(f"Patched {section.name} (lines {section.start}-{section.end})")
+    return previous.model_copy(update={"manim_code": patched_code})
+
+
 
 @app.post("/generate_math_video/")
 async def generate_math_video(request: ContentRequest):
-    print("received request: ", request.topic)
-    safe_filename = generate_safe_filename(request.topic)
-    output_file = f"{safe_filename}.mp4"
-    print("output_file: ", output_file)
-    code = ""
-    message = f"""You are an AI system for generating educational mathematics video content for students of grade {request.grade}. 
+    return await math_video_pipeline(request)
+
+
+async def math_video_pipeline(request: ContentRequest, report=no_progress, script=None):
+    async with workspace("math") as workdir:
+        return await build_math_video(request, workdir, report, script)
+
+
+# grade and topic stay template variables, so braces in a topic are never parsed as placeholders
+math_prompt = ChatPromptTemplate.from_template(
+    """You are an AI system for generating educational mathematics video content for students of grade {grade}. 
             you can add more details relevant to the topic. then generate the manim code for the video. make the visualization colorful. add on screen texts. text must not cover the main contain.
-                Additionally, provide 5 multiple-choice questions (MCQs) related to the topic and long video title and desc.make animation long with some examples.follow this strictly.
+                make animation long with some examples.follow this strictly.
+
+                Structure the scene as a construct method that calls one helper method per part of the video.
 
-                The topic is: {request.topic}
+                The topic is: {topic}
 
-                {{format_instructions}}
                 If the topic is not related to education, leave each field empty.
                 """
-    
-    parser = PydanticOutputParser(pydantic_object=MathContent)
-    prompt_template = ChatPromptTemplate.from_template(message)
+)
+
+
+async def fill_scene_template(request: ContentRequest, template):
+    """Have the model fill only the parameters and narration of a prewritten scene.
+
+    Returns MathContent with the template's code, or None if the model declines
+    the template or the answer can't be used, in which case the caller asks for
+    the whole scene.
+    """
+    template_content = create_model(
+        "TemplateContent",
+        use_template=(bool, Field(description=f"true only if an animation of {template.name} is what the topic is about, "
+                                              "false if the topic needs a different animation")),
+        params=(template.params, Field(description=f"Parameters of the {template.name} animation for this topic")),
+        caption=(str, Field(description="Narration script to narrate the texts in video and the video itself in one sentence")),
+    )
+    prompt = ChatPromptTemplate.from_template(
+        """You are an AI system for generating educational mathematics video content for students of grade {grade}.
+        An animation of {template} is already written. If the topic is about something else, set use_template to false.
+        Otherwise choose its parameters so that it fits the topic, and write the narration.
+
+        The topic is: {topic}"""
+    ).format_prompt(grade=request.grade, topic=request.topic, template=template.name)
+    try:
+        content = await invoke_structured(prompt.to_messages(), template_content)
+    except Exception as e:
+        print(f"Could not fill the {template.name} template, generating the whole scene: {e}")
+        return None
+    if not content.use_template:
+        print(f"The {template.name} template does not fit '{request.topic}', generating the whole scene")
+        return None
+    print(f"Using the {template.name} scene template")
+    return MathContent(
+        manim_code=template.build(content.params),
+        caption=content.caption,
+    )
+
+
+async def build_math_video(request: ContentRequest, workdir: Path, report=no_progress, script=None):
+    """Generate, render and publish a math video, retrying with the render error.
+
+    script is an answer already fetched for the first attempt, e.g. by a batch.
+    The MCQs and title are generated once, next to the code, and are not
+    regenerated when a render is retried.
+    """
+    details_task = asyncio.create_task(generate_video_details(request))
+    try:
+        return await render_math_video(request, workdir, details_task, report, script)
+    finally:
+        await cancel_task(details_task)
+
+
+async def render_math_video(request: ContentRequest, workdir: Path, details_task, report=no_progress, script=None):
+    print("received request: ", request.topic)
+    safe_filename = generate_safe_filename(request.topic)
+    output_file = f"{safe_filename}.mp4"
+    print("output_file: ", output_file)
+    code_path = workdir / "manim_code.py"
+    media_dir = workdir / "media"
+    audio_path = str(workdir / "temp_math_audio.mp3")
+    final_video_path = str(workdir / "final_video.mp4")
+    code = ""
+    previous_response = None
+    error_message = ""
+    prompt_template = math_prompt
+    first_prompt = prompt_template.format_prompt(grade=request.grade, topic=request.topic).to_string()
+    # (value, task) of work started while the answer was still streaming
+    early = {}
+
+    async def render_code(code):
+        with open(code_path, 'w') as f:
+            f.write(code)
+        return str(await run_manim(code_path, output_file, media_dir))
+
+    async def synthesize(caption):
+        with stage("tts"):
+            await run_io(text_to_speech, caption, audio_path)
+
+    async def on_field(key, index, value):
+        # the render starts as soon as the code is complete, while the caption is still being generated
+        if key == "manim_code" and value:
+            early["render"] = (value, asyncio.create_task(render_code(value)))
+        elif key == "caption" and value:
+            early["tts"] = (value, asyncio.create_task(synthesize(value)))
+
+    async def take_early(name, value):
+        """The task started early for value, or None if there is none."""
+        started = early.pop(name, None)
+        if started is None:
+            return None
+        if started[0] == value:
+            return started[1]
+        # let a stale task finish before its output file is written again
+        await asyncio.gather(started[1], return_exceptions=True)
+        return None
+
+    async def cancel_early():
+        tasks = [task for _, task in early.values()]
+        early.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
     for attempt in range(MAX_RETRIES):
         print("attempt: ", attempt)
+        # each attempt owns an equal slice of the progress bar
+        base_progress = attempt / MAX_RETRIES
+        step = 1 / MAX_RETRIES
+        parsed_response = None
+        thumbnails_task = None
         try:
-            prompt = prompt_template.format_prompt(
-                grade=request.grade,
-                topic=request.topic,
-                format_instructions=parser.get_format_instructions()
-            )
-            response = await chate.ainvoke(prompt.to_messages())
-            parsed_response = parser.parse(response.content)
-            
+            await report(f"llm (attempt {attempt + 1})", base_progress)
+            prompt = prompt_template.format_prompt(grade=request.grade, topic=request.topic)
+            # only the first attempt may reuse a cached answer, retries need fresh code
+            if attempt == 0:
+                parsed_response = script or await llm_cache.get("math", first_prompt, topic=request.topic, scope=request.grade)
+                # common topics only need a handful of parameters instead of a whole scene
+                template = match_template(request.topic) if parsed_response is None else None
+                if template is not None:
+                    parsed_response = await fill_scene_template(request, template)
+            elif previous_response is not None:
+                # fix only the broken function, the unchanged animations before it are not re-rendered
+                parsed_response = await patch_failing_section(previous_response, error_message)
+            if parsed_response is None:
+                parsed_response = await invoke_structured(prompt.to_messages(), MathContent, on_field)
+
             if not parsed_response.manim_code:
                 raise ValueError("No Python code found in the API response.")
 
-            # Write only the extracted Python code to the file
-            with open('manim_code.py', 'w') as f:
-                f.write(parsed_response.manim_code)
-            print("python code written to file attempt: ", attempt)
+            # Write only the extracted Python code to the file and run it, unless that already started
             code = parsed_response.manim_code
-            # Run the generated Manim file
-            await run_manim(output_file)
+            render_task = await take_early("render", code)
+            tts_task = await take_early("tts", parsed_response.caption)
+            await report(f"render (attempt {attempt + 1})", base_progress + 0.2 * step)
+            if render_task is not None:
+                generic_vid_path = await render_task
+            else:
+                generic_vid_path = await render_code(code)
             print(f"Attempt {attempt + 1}: Successfully ran the generated code")
 
-            # Construct the path to the generated video
-            generic_vid_path = f"media/videos/manim_code/480p15/{output_file}"
-            text_to_speech(parsed_response.caption, "temp_math_audio.mp3")
-            add_audio_to_video(generic_vid_path, "temp_math_audio.mp3", "final_video.mp4")
+            await report("audio", base_progress + 0.6 * step)
+            if tts_task is not None:
+                await tts_task
+            else:
+                await synthesize(parsed_response.caption)
+            # posters come from the silent render while the narration is muxed onto it
+            thumbnails_task = asyncio.create_task(publish_thumbnails(generic_vid_path, workdir))
+            with stage("encode"):
+                await run_io(add_audio_to_video, generic_vid_path, audio_path, final_video_path)
             # Check if the video file exists
-            if not os.path.exists("final_video.mp4"):
+            if not os.path.exists(final_video_path):
                 raise FileNotFoundError("Video file not created")
             
             
-            video_url = await upload_to_cloudinary("final_video.mp4", 'video')
-            
-            # # # Clean up files
-            # for file_path in [generic_vid_path, "manim_code.py", "temp_math_audio.mp3", ""final_video.mp4""]:
-            #     if os.path.exists(file_path):
-            #         os.remove(file_path)
-            
-            return {
-                "video_title": parsed_response.short_topic,
-                "caption": parsed_response.caption,
-                "description": parsed_response.caption,
-                "thumbnail": "",
-                "video_link": video_url,
-                "mcqs": parsed_response.mcqs
-            }
-            
+            await report("upload", base_progress + 0.8 * step)
+            with stage("upload"):
+                video_url = await run_io(upload_file, final_video_path, 'video')
+            thumbnails = await thumbnails_task
+            break
+
+        except SpeechError as e:
+            # nothing is wrong with the code, asking the model to fix it would not help
+            raise HTTPException(status_code=502, detail=str(e))
         except Exception as e:
             error_message = str(e)
             print(f"Attempt {attempt + 1} failed: {error_message}")
+            if parsed_response is not None:
+                llm_cache.discard(parsed_response)
+            # only code that was written and ran can be patched
+            previous_response = parsed_response if parsed_response is not None and code == parsed_response.manim_code else None
 
             if attempt < MAX_RETRIES - 1:
                 # Prepare for retry
                 retry_message = f"""You are a helpful assistant that creates video for kids for educational purposes.
-                    The previous attempt to generate Manim code for '{request.topic}' failed with the error: {error_message}. 
+                    The previous attempt to generate Manim code for '{escape_braces(request.topic)}' failed with the error: {escape_braces(error_message)}. 
                     Please provide an improved version of the code that addresses this issue. 
                     Remember to name the class as 'Video' for the scene.
-                    Here's the previously generated code for reference:\n\n{code}"""
+                    Here's the previously generated code for reference:\n\n{escape_braces(code)}"""
                 
                 message = retry_message
+                prompt_template = ChatPromptTemplate.from_template(message)
             else:
                 # All attempts failed
                 raise HTTPException(status_code=500, detail=f"Failed to generate video after {MAX_RETRIES} attempts. Last error: {error_message}")
+        finally:
+            # nothing started for this attempt may keep writing to its files
+            await cancel_early()
+            if thumbnails_task is not None:
+                await cancel_task(thumbnails_task)
+
+    # the video rendered, a failure from here on has nothing to do with the code
+    try:
+        details = await details_task
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to generate the video details: {e}")
+    # cache only code that is known to render
+    await llm_cache.put("math", first_prompt, parsed_response, topic=request.topic, scope=request.grade)
+
+    # the preview is served now, higher qualities follow in the background
+    video_id = uuid.uuid4().hex
+    await quality_ladder.publish(video_id, video_url, code, parsed_response.caption)
+    renditions = await quality_ladder.status(video_id)
+    return {
+        "video_title": details.short_topic,
+        "caption": parsed_response.caption,
+        "description": details.description,
+        **thumbnails,
+        "video_link": video_url,
+        "video_id": video_id,
+        "renditions": renditions["renditions"],
+        "pending": renditions["pending"],
+        "mcqs": details.mcqs
+    }
+
+
+async def run_math_video_job(payload: dict, report):
+    result = await math_video_pipeline(ContentRequest(**payload), report)
+    return jsonable_encoder(result)
+
+
+async def run_educational_content_job(payload: dict, report):
+    result = await educational_content_pipeline(ContentRequest(**payload), report)
+    return jsonable_encoder(result)
+
+
+async def run_progressive_educational_job(payload: dict, report):
+    result = await progressive_educational_pipeline(ContentRequest(**payload), report)
+    return jsonable_encoder(result)
+
+
+# pipeline, prompt, answer schema and LLM cache kind of every kind a batch can hold
+BATCH_PIPELINES = {
+    "math_video": (math_video_pipeline, math_prompt, MathContent, "math"),
+    "educational_content": (educational_content_pipeline, educational_prompt, EducationalContent, "educational"),
+}
+
+
+class BatchRequest(BaseModel):
+    items: List[ContentRequest]
+
+
+async def prefetch_scripts(kind: str, requests: list) -> list:
+    """Fetch the first LLM answer of every request in one concurrent batch.
+
+    Cached answers are reused. A request whose call or parse fails gets None
+    and makes its own call when its pipeline runs.
+    """
+    _, template, schema, cache_kind = BATCH_PIPELINES[kind]
+    prompts = [template.format_prompt(grade=request.grade, topic=request.topic) for request in requests]
+    scripts = list(await asyncio.gather(*(
+        llm_cache.get(cache_kind, prompt.to_string(), topic=request.topic, scope=request.grade)
+        for request, prompt in zip(requests, prompts)
+    )))
+    misses = [i for i, script in enumerate(scripts) if script is None]
+    if kind == "math_video":
+        # topics with a scene template fill its parameters instead of writing code
+        misses = [i for i in misses if match_template(requests[i].topic) is None]
+    if not misses:
+        return scripts
+    with stage("llm_call"):
+        responses = await bind_schema(chate, schema).abatch(
+            [prompts[i].to_messages() for i in misses],
+            config={"max_concurrency": BATCH_LLM_CONCURRENCY},
+            return_exceptions=True,
+        )
+    for i, response in zip(misses, responses):
+        if isinstance(response, Exception):
+            print(f"Batch LLM call for '{requests[i].topic}' failed: {response}")
+            continue
+        record_tokens(chate.model_name, response)
+        try:
+            with stage("parse"):
+                scripts[i] = parse_tool_call(response, schema)
+        except Exception as e:
+            print(f"Batch LLM answer for '{requests[i].topic}' could not be parsed: {e}")
+    return scripts
+
+
+async def run_batch_job(payload: dict, report):
+    pipeline = BATCH_PIPELINES[payload["kind"]][0]
+    requests = [ContentRequest(**item) for item in payload["items"]]
+
+    async def prefetch(distinct):
+        return await prefetch_scripts(payload["kind"], distinct)
+
+    async def run_item(request, script):
+        return jsonable_encoder(await pipeline(request, script=script))
+
+    return await run_batch(requests, prefetch, run_item, report)
+
+
+quality_ladder = QualityLadder(RenditionStore(), JobStore())
+janitor = Janitor()
+
+
+@app.get("/videos/{video_id}/renditions")
+async def video_renditions(video_id: str):
+    """Every published quality of a math video, poll until pending is empty."""
+    renditions = await quality_ladder.status(video_id)
+    if renditions is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return renditions
+
+
+job_queue = JobQueue(JobStore(), {
+    "math_video": run_math_video_job,
+    "educational_content": run_educational_content_job,
+    # poll GET /jobs/{id} for info.manifest_url to start playback early
+    "educational_content_progressive": run_progressive_educational_job,
+    # submitted through POST /batch/{kind}, results are per item
+    "batch": run_batch_job,
+})
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_queue.start()
+    await quality_ladder.start()
+    await janitor.start()
+    if MANIM_WARM_POOL:
+        await render_pool.prewarm()
+
+
+@app.post("/jobs/{kind}", status_code=202)
+async def submit_job(kind: str, request: ContentRequest):
+    if kind == "batch":
+        raise HTTPException(status_code=400, detail="Submit batches to POST /batch/{kind}")
+    try:
+        job_id = await job_queue.submit(kind, jsonable_encoder(request))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind '{kind}'")
+    return {"job_id": job_id, "status": QUEUED}
+
+
+@app.post("/batch/{kind}", status_code=202)
+async def submit_batch(kind: str, request: BatchRequest):
+    """Queue a list of requests as one job, poll /jobs/{job_id}/result for per-item results."""
+    if kind not in BATCH_PIPELINES:
+        raise HTTPException(status_code=404, detail=f"Unknown batch kind '{kind}'")
+    if not request.items:
+        raise HTTPException(status_code=400, detail="The batch is empty")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch holds at most {BATCH_MAX_ITEMS} items")
+    job_id = await job_queue.submit("batch", {"kind": kind, "items": jsonable_encoder(request.items)})
+    return {"job_id": job_id, "status": QUEUED}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("result")
+    return job
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != SUCCEEDED:
+        return JSONResponse(status_code=202, content={"status": job["status"], "stage": job["stage"], "progress": job["progress"]})
+    return job["result"]
+
 
-    # This line should never be reached due to the loop structure, but including it for completeness
-    raise HTTPException(status_code=500, detail="Unexpected error in video generation process")
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,335 @@
+"""Managed manim subprocesses.
+
+Renders run as child processes in their own session with a wall-clock timeout
+and CPU / address-space rlimits, so a runaway generated scene is killed instead
+of hanging a worker. stderr is captured and raised as ManimRenderError for the
+retry prompt. At most MAX_CONCURRENT_RENDERS manim processes run per host, even
+with several app processes: every render holds one of that many slot files in
+MANIM_SLOTS_DIR under an flock, which the kernel releases if its process dies.
+Files with several Scene classes can render each scene in parallel.
+
+With MANIM_WARM_POOL=1 scenes are rendered by long-lived workers that already
+imported manim (see manim_worker.py) instead of a fresh CLI process each, which
+saves interpreter, import and config startup on every render. A worker is
+replaced after MANIM_WORKER_MAX_JOBS jobs or once it grows past
+MANIM_WORKER_MAX_RSS_BYTES, and killed on timeout like a CLI render.
+"""
+import ast
+import asyncio
+import fcntl
+import json
+import os
+import resource
+import signal
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from executor import run_io
+from ffmpeg_tools import concat_copy
+from metrics import MEMORY_BUCKETS, observe
+
+MANIM_TIMEOUT = float(os.getenv("MANIM_TIMEOUT", "300"))
+MANIM_CPU_SECONDS = int(os.getenv("MANIM_CPU_SECONDS", "600"))
+MANIM_MEMORY_BYTES = int(os.getenv("MANIM_MEMORY_BYTES", str(4 * 1024 ** 3)))
+MAX_CONCURRENT_RENDERS = int(os.getenv("MAX_CONCURRENT_RENDERS", str(os.cpu_count() or 2)))
+# shared by every app process on the host, the slot files in it bound concurrent renders
+MANIM_SLOTS_DIR = Path(os.getenv("MANIM_SLOTS_DIR", Path(tempfile.gettempdir()) / "manim_render_slots"))
+SLOT_POLL_INTERVAL = 0.2
+MANIM_PARALLEL_SCENES = os.getenv("MANIM_PARALLEL_SCENES", "1") == "1"
+MANIM_WARM_POOL = os.getenv("MANIM_WARM_POOL", "1") == "1"
+# idle warm workers kept around, busy ones are still bounded by MAX_CONCURRENT_RENDERS
+MANIM_WARM_WORKERS = int(os.getenv("MANIM_WARM_WORKERS", "2"))
+MANIM_WORKER_MAX_JOBS = int(os.getenv("MANIM_WORKER_MAX_JOBS", "50"))
+MANIM_WORKER_MAX_RSS_BYTES = int(os.getenv("MANIM_WORKER_MAX_RSS_BYTES", str(1536 * 1024 ** 2)))
+WORKER_START_TIMEOUT = 120
+WORKER_SCRIPT = Path(__file__).with_name("manim_worker.py")
+# how much of manim's stderr is kept for error messages and the retry prompt
+STDERR_TAIL_CHARS = 3000
+
+
+
+class RenderSlots:
+    """At most `slots` renders at a time across every process that shares `directory`."""
+
+    def __init__(self, directory: Path, slots: int):
+        self.directory = Path(directory)
+        self.slots = slots
+        # renders of this process wait here instead of polling the slot files
+        self._local = asyncio.Semaphore(slots)
+
+    def _try_lock(self):
+        """The descriptor of a free slot file, now locked, or None if all are taken."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for n in range(self.slots):
+            fd = os.open(self.directory / f"slot_{n}.lock", os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @asynccontextmanager
+    async def hold(self):
+        async with self._local:
+            fd = self._try_lock()
+            while fd is None:
+                # every slot is taken by other processes on the host
+                await asyncio.sleep(SLOT_POLL_INTERVAL)
+                fd = self._try_lock()
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+_render_slots = RenderSlots(MANIM_SLOTS_DIR, MAX_CONCURRENT_RENDERS)
+
+
+class ManimRenderError(Exception):
+    def __init__(self, message, stderr=""):
+        self.stderr = stderr
+        if stderr:
+            message = f"{message}\n{stderr[-STDERR_TAIL_CHARS:]}"
+        super().__init__(message)
+
+
+def find_scene_classes(code: str) -> list:
+    """Names of the Scene subclasses defined in the code, in definition order."""
+    tree = ast.parse(code)
+    scenes = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        for base in node.bases:
+            name = base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+            if name.endswith("Scene") or name in scenes:
+                scenes.append(node.name)
+                break
+    return scenes
+
+
+def limit_resources():
+    """Runs in the child before exec to cap CPU time and memory."""
+    resource.setrlimit(resource.RLIMIT_CPU, (MANIM_CPU_SECONDS, MANIM_CPU_SECONDS))
+    resource.setrlimit(resource.RLIMIT_AS, (MANIM_MEMORY_BYTES, MANIM_MEMORY_BYTES))
+
+
+def limit_memory():
+    """Runs in a warm worker before exec, the worker limits CPU time per job itself."""
+    resource.setrlimit(resource.RLIMIT_AS, (MANIM_MEMORY_BYTES, MANIM_MEMORY_BYTES))
+
+
+def kill_group(process):
+    # manim spawns ffmpeg / latex children, take them down too
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def run_limited(args: list, cwd=None, timeout=MANIM_TIMEOUT):
+    """Run a command under the render limits and return (returncode, stdout, stderr)."""
+    async with _render_slots.hold():
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=cwd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            preexec_fn=limit_resources,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            kill_group(process)
+            await process.wait()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise ManimRenderError(f"Render timed out after {timeout:.0f}s")
+        return process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+
+class WarmWorker:
+    """One manim_worker.py process talking JSON lines over its stdin and stdout."""
+
+    def __init__(self, process):
+        self.process = process
+        self.jobs = 0
+        self.rss = 0
+
+    @classmethod
+    async def start(cls):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, str(WORKER_SCRIPT),
+            cwd=WORKER_SCRIPT.parent,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+            preexec_fn=limit_memory,
+            # error replies carry a traceback and the manim log tail
+            limit=2 ** 20,
+        )
+        worker = cls(process)
+        try:
+            await worker._read(WORKER_START_TIMEOUT)
+        except BaseException:
+            await worker.kill()
+            raise
+        return worker
+
+    async def _read(self, timeout):
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        if not line:
+            returncode = await self.process.wait()
+            if returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                raise ManimRenderError("Render worker exceeded its CPU or memory limit")
+            raise ManimRenderError(f"Render worker exited with code {returncode}")
+        reply = json.loads(line)
+        self.rss = reply.get("rss", 0)
+        return reply
+
+    async def run(self, job: dict, timeout):
+        self.jobs += 1
+        self.process.stdin.write((json.dumps(job) + "\n").encode())
+        await self.process.stdin.drain()
+        return await self._read(timeout)
+
+    async def kill(self):
+        kill_group(self.process)
+        await self.process.wait()
+
+    async def close(self):
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 10)
+        except asyncio.TimeoutError:
+            await self.kill()
+
+
+class WarmRenderPool:
+    def __init__(self, size=MANIM_WARM_WORKERS, max_jobs=MANIM_WORKER_MAX_JOBS, max_rss=MANIM_WORKER_MAX_RSS_BYTES):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._idle = []
+
+    async def prewarm(self):
+        """Start the idle workers ahead of the first render."""
+        workers = await asyncio.gather(*(WarmWorker.start() for _ in range(self.size - len(self._idle))),
+                                       return_exceptions=True)
+        for worker in workers:
+            if isinstance(worker, WarmWorker):
+                self._idle.append(worker)
+            else:
+                print(f"Could not start a warm manim worker: {worker}")
+
+    async def _release(self, worker: WarmWorker, reply: dict):
+        if (reply.get("fatal") or worker.jobs >= self.max_jobs or worker.rss >= self.max_rss
+                or len(self._idle) >= self.size):
+            await worker.close()
+        else:
+            self._idle.append(worker)
+
+    async def render(self, code_path, scene_name, quality, output_file, media_dir, timeout=MANIM_TIMEOUT,
+                     dry_run=False):
+        job = {
+            "code_path": str(Path(code_path).resolve()),
+            "scene": scene_name,
+            "quality": quality,
+            "output_file": output_file,
+            "media_dir": str(Path(media_dir).resolve()),
+            "cpu_seconds": MANIM_CPU_SECONDS,
+            "dry_run": dry_run,
+        }
+        async with _render_slots.hold():
+            # drop idle workers that died in the meantime
+            while self._idle and self._idle[-1].process.returncode is not None:
+                self._idle.pop()
+            worker = self._idle.pop() if self._idle else await WarmWorker.start()
+            try:
+                reply = await worker.run(job, timeout)
+            except asyncio.TimeoutError:
+                await worker.kill()
+                raise ManimRenderError(f"Render timed out after {timeout:.0f}s")
+            except BaseException:
+                await worker.kill()
+                raise
+            await self._release(worker, reply)
+        if "peak_rss" in reply:
+            observe("manim_render_peak_rss_bytes", reply["peak_rss"], buckets=MEMORY_BUCKETS, quality=quality)
+        if not reply["ok"]:
+            raise ManimRenderError(f"Scene {scene_name} failed", reply["error"])
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(worker.close() for worker in idle))
+
+
+render_pool = WarmRenderPool()
+
+
+def manim_command(code_path, scene_name, quality, output_file, media_dir, extra_args=()):
+    return [
+        sys.executable, "-m", "manim", "render", str(code_path), scene_name,
+        f"-q{quality}", "-o", output_file, "--media_dir", str(media_dir), *extra_args,
+    ]
+
+
+async def render_scene(code_path, scene_name, quality, output_file, media_dir, timeout=MANIM_TIMEOUT, extra_args=()):
+    """Render a single scene, raising ManimRenderError on failure."""
+    if MANIM_WARM_POOL and set(extra_args) <= {"--dry_run"}:
+        return await render_pool.render(code_path, scene_name, quality, output_file, media_dir, timeout,
+                                        dry_run="--dry_run" in extra_args)
+    code_path = Path(code_path)
+    returncode, _, stderr = await run_limited(
+        manim_command(code_path, scene_name, quality, output_file, media_dir, extra_args),
+        cwd=code_path.parent,
+        timeout=timeout,
+    )
+    if returncode != 0:
+        if returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+            raise ManimRenderError(f"Scene {scene_name} exceeded its CPU or memory limit", stderr)
+        raise ManimRenderError(f"Scene {scene_name} failed with exit code {returncode}", stderr)
+
+
+async def render_file(code_path, output_file, media_dir, video_dir, quality="l", parallel=MANIM_PARALLEL_SCENES):
+    """Render every scene in code_path into video_dir/output_file.
+
+    A single scene is written straight to output_file. Multiple scenes are
+    rendered (in parallel processes when enabled) and joined in definition order.
+    """
+    code_path = Path(code_path)
+    video_dir = Path(video_dir)
+    scenes = find_scene_classes(code_path.read_text())
+    if not scenes:
+        raise ManimRenderError("No Scene subclass found in the generated code")
+    if len(scenes) == 1:
+        await render_scene(code_path, scenes[0], quality, output_file, media_dir)
+        if not (video_dir / output_file).exists():
+            raise ManimRenderError(f"Scene {scenes[0]} rendered no video, it must play at least one animation")
+        return video_dir / output_file
+
+    stem = Path(output_file).stem
+    part_files = [f"{stem}_{scene}.mp4" for scene in scenes]
+    if parallel:
+        tasks = [asyncio.create_task(render_scene(code_path, scene, quality, part, media_dir))
+                 for scene, part in zip(scenes, part_files)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # one scene failed, don't leave the others burning CPU
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    else:
+        for scene, part in zip(scenes, part_files):
+            await render_scene(code_path, scene, quality, part, media_dir)
+    await run_io(concat_copy, [video_dir / part for part in part_files], str(video_dir / output_file))
+    return video_dir / output_file
@@ -0,0 +1,81 @@
+"""Cheap checks on generated manim code before paying for a full render.
+
+check_code runs in milliseconds: it parses the AST, requires a Scene subclass
+and rejects imports or builtins that generated scenes have no business using.
+dry_run then executes every scene with manim's --dry_run, which plays all
+animations without writing frames, so runtime errors show up in seconds.
+"""
+import ast
+import asyncio
+import os
+
+from manim_runner import ManimRenderError, find_scene_classes, render_scene
+
+MANIM_DRY_RUN = os.getenv("MANIM_DRY_RUN", "1") == "1"
+DRY_RUN_TIMEOUT = float(os.getenv("DRY_RUN_TIMEOUT", "90"))
+
+ALLOWED_MODULES = {
+    "manim", "numpy", "math", "random", "itertools", "functools", "colour",
+    "typing", "dataclasses", "collections", "fractions", "decimal", "string",
+}
+FORBIDDEN_CALLS = {"exec", "eval", "compile", "open", "__import__", "input", "breakpoint", "globals", "vars"}
+
+
+class ManimValidationError(ValueError):
+    pass
+
+
+def check_code(code: str, expected_scene: str = None) -> list:
+    """Statically validate generated code and return its Scene class names."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise ManimValidationError(f"Syntax error on line {e.lineno}: {e.msg}\n{(e.text or '').rstrip()}")
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        else:
+            modules = []
+        for module in modules:
+            if module.split(".")[0] not in ALLOWED_MODULES:
+                raise ManimValidationError(f"Import of '{module}' on line {node.lineno} is not allowed")
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FORBIDDEN_CALLS:
+            raise ManimValidationError(f"Call to '{node.func.id}' on line {node.lineno} is not allowed")
+        if isinstance(node, ast.Attribute) and node.attr.startswith("__") and node.attr.endswith("__") \
+                and node.attr not in ("__init__", "__name__"):
+            raise ManimValidationError(f"Access to '{node.attr}' on line {node.lineno} is not allowed")
+
+    scenes = find_scene_classes(code)
+    if not scenes:
+        raise ManimValidationError("No Scene subclass found, define a class that inherits from Scene")
+    if expected_scene and expected_scene not in scenes:
+        raise ManimValidationError(f"Expected a Scene class named '{expected_scene}', found {', '.join(scenes)}")
+    for scene in tree.body:
+        if isinstance(scene, ast.ClassDef) and scene.name in scenes:
+            if not any(isinstance(item, ast.FunctionDef) and item.name == "construct" for item in scene.body):
+                raise ManimValidationError(f"Scene '{scene.name}' has no construct method")
+    return scenes
+
+
+async def dry_run(code_path, media_dir, scenes: list, timeout=DRY_RUN_TIMEOUT):
+    """Play every scene without rendering frames, raising ManimValidationError on failure."""
+    try:
+        await asyncio.gather(*(
+            render_scene(code_path, scene, "l", f"dry_run_{scene}.mp4", media_dir,
+                         timeout=timeout, extra_args=("--dry_run",))
+            for scene in scenes
+        ))
+    except ManimRenderError as e:
+        raise ManimValidationError(f"Dry run failed: {e}")
+
+
+async def validate(code_path, media_dir, expected_scene: str = None):
+    """Run the static checks and, if enabled, the dry run."""
+    with open(code_path) as f:
+        scenes = check_code(f.read(), expected_scene)
+    if MANIM_DRY_RUN:
+        await dry_run(code_path, media_dir, scenes)
@@ -0,0 +1,117 @@
+"""Long-lived manim render worker, started by manim_runner.WarmRenderPool.
+
+manim is imported once at startup. Each job read from stdin is a JSON line
+naming a file and a scene; the file is executed in a fresh namespace and the
+scene rendered under a temporary config, so nothing a scene sets leaks into the
+next job. One JSON reply per job is written to the original stdout, which is
+reserved for the protocol while manim's own output goes to stderr.
+"""
+import json
+import logging
+import os
+import resource
+import sys
+import traceback
+from collections import deque
+
+_protocol = os.fdopen(os.dup(1), "w", buffering=1)
+os.dup2(2, 1)
+sys.stdout = sys.stderr
+
+import manim  # noqa: E402  heavy import done once per worker
+
+QUALITIES = {"l": "low_quality", "m": "medium_quality", "h": "high_quality", "p": "production_quality", "k": "fourk_quality"}
+LOG_TAIL_LINES = 60
+
+
+class TailHandler(logging.Handler):
+    """Keeps the last manim log lines of the current job for its error reply."""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = deque(maxlen=LOG_TAIL_LINES)
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Restart the kernel's peak RSS count so the next peak covers one job, where the kernel allows it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return rss_bytes()
+
+
+def limit_cpu(seconds: int):
+    """RLIMIT_CPU counts the whole process life, so each job gets its own budget on top."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + seconds, hard))
+
+
+def render(job: dict):
+    code_path = job["code_path"]
+    workdir = os.path.dirname(code_path)
+    os.chdir(workdir)
+    namespace = {"__name__": "__manim_scene__", "__file__": code_path}
+    with manim.tempconfig({}):
+        cfg_path = os.path.join(workdir, "manim.cfg")
+        if os.path.exists(cfg_path):
+            manim.config.digest_file(cfg_path)
+        manim.config.input_file = code_path
+        manim.config.quality = QUALITIES[job["quality"]]
+        manim.config.media_dir = job["media_dir"]
+        manim.config.output_file = job["output_file"]
+        manim.config.write_to_movie = True
+        if job.get("dry_run"):
+            manim.config.dry_run = True
+        with open(code_path) as f:
+            exec(compile(f.read(), code_path, "exec"), namespace)
+        namespace[job["scene"]]().render()
+
+
+def main():
+    tail = TailHandler()
+    logging.getLogger("manim").addHandler(tail)
+    _protocol.write(json.dumps({"ready": True, "rss": rss_bytes()}) + "\n")
+    for line in sys.stdin:
+        job = json.loads(line)
+        tail.lines.clear()
+        limit_cpu(job["cpu_seconds"])
+        reset_peak_rss()
+        try:
+            render(job)
+            reply = {"ok": True}
+        except Exception as e:
+            log = "\n".join(tail.lines)
+            reply = {"ok": False, "error": f"{log}\n{traceback.format_exc()}".strip(),
+                     "fatal": isinstance(e, MemoryError)}
+        reply["rss"] = rss_bytes()
+        reply["peak_rss"] = peak_rss_bytes()
+        _protocol.write(json.dumps(reply) + "\n")
+
+
+if __name__ == "__main__":
+    main()
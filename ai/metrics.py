@@ -0,0 +1,176 @@
+"""Stage timing, resource and token metrics for the generation pipeline.
+
+Wrap a pipeline step in `with stage("manim_render"):` to record its wall time
+and the CPU time the whole process and its reaped subprocesses, such as ffmpeg
+runs, used meanwhile. That CPU time is process-wide: stages running at the same
+time each count all of it, and long-lived manim workers are not included. The
+app's resident memory is sampled when a stage starts and ends, and the larger
+sample is recorded for the stage. Warm manim workers report their own peak per
+render, which manim_runner records as manim_render_peak_rss_bytes. Every stage
+is also written as one JSON log line tagged with the current request id. render_metrics() returns all
+metrics in the Prometheus text exposition format for the /metrics endpoint.
+"""
+import contextvars
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+MEMORY_BUCKETS = tuple(mb * 1024 ** 2 for mb in (64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192))
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_help = {}
+
+
+def _labels_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def describe(name: str, kind: str, text: str):
+    _help[name] = (kind, text)
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        key = (name, _labels_key(labels))
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[(name, _labels_key(labels))] = value
+
+
+def observe(name: str, value: float, buckets=BUCKETS, **labels):
+    with _lock:
+        key = (name, _labels_key(labels))
+        histogram = _histograms.setdefault(key, {"bounds": buckets, "buckets": [0] * len(buckets), "sum": 0.0,
+                                                 "count": 0})
+        for i, bound in enumerate(histogram["bounds"]):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+describe("pipeline_stage_seconds", "histogram", "Wall time of a pipeline stage")
+describe("pipeline_stage_process_cpu_seconds", "histogram",
+         "CPU time of the whole process and its reaped children while a stage ran")
+describe("pipeline_stage_rss_bytes", "histogram", "App resident memory sampled at the start and end of a stage")
+describe("manim_render_peak_rss_bytes", "histogram", "Peak resident memory of a warm manim worker during one render")
+describe("process_peak_rss_bytes", "gauge", "Peak resident memory of the app process")
+describe("pipeline_stage_failures_total", "counter", "Stages that raised")
+describe("llm_tokens_total", "counter", "Tokens used by LLM calls")
+describe("http_request_seconds", "histogram", "HTTP request latency")
+
+
+def log_event(event: str, **fields):
+    """Print one structured log line tagged with the current request id."""
+    record = {"ts": round(time.time(), 3), "event": event, "request_id": request_id_var.get(), **fields}
+    print(json.dumps(record, default=str), file=sys.stdout, flush=True)
+
+
+def cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rss_bytes() -> int:
+    """Current resident memory of this process, the lifetime peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss_bytes()
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Time a pipeline stage and record it as metrics and a log line."""
+    wall_start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    rss_start = rss_bytes()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        inc("pipeline_stage_failures_total", stage=name)
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+        rss_end = rss_bytes()
+        observe("pipeline_stage_seconds", wall, stage=name)
+        observe("pipeline_stage_process_cpu_seconds", cpu, stage=name)
+        observe("pipeline_stage_rss_bytes", max(rss_start, rss_end), buckets=MEMORY_BUCKETS, stage=name)
+        set_gauge("process_peak_rss_bytes", peak_rss_bytes())
+        log_event("stage", stage=name, ok=ok, wall_s=round(wall, 3), process_cpu_s=round(cpu, 3),
+                  rss_mb=round(rss_end / 1024 ** 2, 1), rss_delta_mb=round((rss_end - rss_start) / 1024 ** 2, 1),
+                  **fields)
+
+
+def record_tokens(model: str, response):
+    """Count the tokens reported on a langchain chat response."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+    if prompt_tokens is None:
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt_tokens = token_usage.get("prompt_tokens")
+        completion_tokens = token_usage.get("completion_tokens")
+    if prompt_tokens is None:
+        return
+    inc("llm_tokens_total", prompt_tokens, model=model, type="prompt")
+    inc("llm_tokens_total", completion_tokens or 0, model=model, type="completion")
+    log_event("llm_tokens", model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        series = {}
+        for (name, labels), value in _counters.items():
+            series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in _gauges.items():
+            series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), histogram in _histograms.items():
+            out = series.setdefault(name, [])
+            for bound, count in zip(histogram["bounds"], histogram["buckets"]):
+                out.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            out.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            out.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            out.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    for name in sorted(series):
+        if name in _help:
+            kind, text = _help[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+        lines.extend(series[name])
+    return "\n".join(lines) + "\n"
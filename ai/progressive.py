@@ -0,0 +1,131 @@
+"""Progressive delivery of educational videos as a growing HLS playlist.
+
+Every scene is generated, encoded into its own MPEG-TS segment and uploaded as
+soon as its images and narration are ready, and scenes can be started while the
+script is still streaming in. The playlist is republished each time the run of
+finished segments from the start grows, so the first scene is watchable while
+later ones are still being generated. An EVENT playlist may not change its
+target duration once published, so it is fixed at HLS_TARGET_DURATION and a
+scene whose narration runs longer fails instead of being published.
+"""
+import asyncio
+import os
+from pathlib import Path
+
+from assembly import encode_segment
+from executor import run_io
+from ffmpeg_tools import media_duration
+from metrics import stage
+from storage import upload_file
+from utils import MAX_CONCURRENCY, generate_single_scene
+
+# upper bound on the length of one scene, in seconds
+HLS_TARGET_DURATION = int(os.getenv("HLS_TARGET_DURATION", "120"))
+
+
+class HlsPlaylist:
+    """An EVENT playlist whose segments may finish out of order."""
+
+    def __init__(self, target_duration: int = HLS_TARGET_DURATION):
+        self.target_duration = target_duration
+        self.segments = {}
+
+    def check(self, index: int, duration: float):
+        # RFC 8216: every EXTINF, rounded to an integer, is at most the target duration
+        if round(duration) > self.target_duration:
+            raise ValueError(f"Scene {index + 1} lasts {duration:.1f}s, "
+                             f"longer than the {self.target_duration}s HLS target duration")
+
+    def add(self, index: int, url: str, duration: float):
+        self.check(index, duration)
+        self.segments[index] = (url, duration)
+
+    def ready_count(self) -> int:
+        """Number of consecutive finished segments starting from the first."""
+        count = 0
+        while count in self.segments:
+            count += 1
+        return count
+
+    def render(self, finished: bool = False) -> str:
+        ready = [self.segments[i] for i in range(self.ready_count())]
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for i, (url, duration) in enumerate(ready):
+            if i:
+                # every segment restarts its timestamps
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(url)
+        if finished:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+
+class SceneDelivery:
+    """Generate, encode and upload scenes as they are started, possibly while the script still streams.
+
+    report(stage, progress, manifest_url=...) is called whenever the playlist grows.
+    """
+
+    def __init__(self, workdir: Path, manifest_id: str, report, max_concurrency=MAX_CONCURRENCY):
+        self.workdir = Path(workdir)
+        self.manifest_id = manifest_id
+        self.report = report
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.playlist = HlsPlaylist()
+        self.playlist_path = self.workdir / "playlist.m3u8"
+        self.publish_lock = asyncio.Lock()
+        self.published = 0
+        self.manifest_url = None
+        self.tasks = {}
+        # known once the whole script has arrived
+        self.total = None
+
+    def start(self, idx: int, scene):
+        if idx not in self.tasks:
+            self.tasks[idx] = asyncio.create_task(self._scene_pipeline(idx, scene))
+
+    async def _publish(self, finished=False):
+        self.playlist_path.write_text(self.playlist.render(finished))
+        with stage("upload"):
+            self.manifest_url = await run_io(upload_file, self.playlist_path, "raw", f"{self.manifest_id}.m3u8")
+
+    async def _scene_pipeline(self, idx, scene):
+        images, audio = await generate_single_scene(idx, scene, self.workdir, self.semaphore)
+        segment = str(self.workdir / f"segment_{idx}.ts")
+        with stage("encode"):
+            await run_io(encode_segment, images, audio, segment)
+        duration = await run_io(media_duration, segment)
+        self.playlist.check(idx, duration)
+        with stage("upload"):
+            url = await run_io(upload_file, segment, "video", f"{self.manifest_id}_{idx}")
+        async with self.publish_lock:
+            self.playlist.add(idx, url, duration)
+            if self.playlist.ready_count() > self.published:
+                self.published = self.playlist.ready_count()
+                await self._publish()
+                total = self.total or len(self.tasks)
+                await self.report(f"published {self.published}/{total} scenes",
+                                  0.2 + 0.6 * self.published / max(total, self.published),
+                                  manifest_url=self.manifest_url)
+        return segment
+
+    async def finish(self, total: int):
+        """Wait for scenes 0..total-1 and close the playlist. Returns (segment_paths, manifest_url)."""
+        self.total = total
+        segments = await asyncio.gather(*(self.tasks[i] for i in range(total)))
+        async with self.publish_lock:
+            await self._publish(finished=True)
+        return list(segments), self.manifest_url
+
+    async def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
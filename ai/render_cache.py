@@ -0,0 +1,157 @@
+"""Content-addressed cache for Manim renders.
+
+Finished videos are stored under a key derived from the normalized scene source,
+the quality flag and the output resolution, so identical or reformatted code is
+never rendered twice. Manim's own Tex/SVG and per-animation partial movie caches
+are shared between workspaces as well, which makes near-identical retries cheap.
+The whole cache is kept under RENDER_CACHE_MAX_BYTES by evicting least recently
+used files.
+"""
+import ast
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+RENDER_CACHE_DIR = Path(os.getenv("RENDER_CACHE_DIR", Path(__file__).parent / "render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+
+RENDERS_DIR = RENDER_CACHE_DIR / "renders"
+TEX_DIR = RENDER_CACHE_DIR / "Tex"
+TEXTS_DIR = RENDER_CACHE_DIR / "texts"
+PARTIALS_DIR = RENDER_CACHE_DIR / "partial_movie_files"
+
+# manim -q flag -> name of the directory manim writes that quality to
+QUALITY_DIRS = {"l": "480p15", "m": "720p30", "h": "1080p60", "p": "1440p60", "k": "2160p60"}
+
+_evict_lock = threading.Lock()
+
+
+def normalize_source(code: str) -> str:
+    """Canonical form of the code so comments and formatting don't change the key."""
+    try:
+        return ast.unparse(ast.parse(code))
+    except SyntaxError:
+        return "\n".join(line.rstrip() for line in code.strip().splitlines())
+
+
+def render_key(code: str, quality: str = "l") -> str:
+    resolution = QUALITY_DIRS[quality]
+    digest = hashlib.sha256()
+    for part in (normalize_source(code), quality, resolution):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def scene_names(code: str) -> list:
+    """Names of the classes defined in the code, which manim uses for partial movie directories."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    return [node.name for node in tree.body if isinstance(node, ast.ClassDef)]
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, falling back to a copy across filesystems."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def lookup(key: str):
+    """Return the cached video for key, or None. A hit refreshes its LRU position."""
+    path = RENDERS_DIR / f"{key}.mp4"
+    if not path.exists():
+        return None
+    os.utime(path)
+    return path
+
+
+def store(key: str, video_path):
+    """Copy a finished render into the cache."""
+    RENDERS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RENDERS_DIR / f"{key}.mp4"
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    shutil.copyfile(video_path, tmp_path)
+    os.replace(tmp_path, path)
+    evict()
+    return path
+
+
+def prepare_workspace(code_path, media_dir, quality: str = "l"):
+    """Point a workspace at the shared Tex/SVG caches and seed its partial movie files.
+
+    Manim reads manim.cfg from the directory of the rendered file, so the Tex and
+    text caches are shared directly. Partial movie files are hard linked in so
+    manim can skip animations whose hash it has already rendered, while each
+    workspace still writes its own partial_movie_file_list.txt.
+    """
+    code_path = Path(code_path)
+    TEX_DIR.mkdir(parents=True, exist_ok=True)
+    TEXTS_DIR.mkdir(parents=True, exist_ok=True)
+    (code_path.parent / "manim.cfg").write_text(
+        f"[CLI]\ntex_dir = {TEX_DIR}\ntext_dir = {TEXTS_DIR}\n"
+    )
+    for scene_name in scene_names(code_path.read_text()):
+        shared = PARTIALS_DIR / quality / scene_name
+        if not shared.is_dir():
+            continue
+        local = partial_movie_dir(code_path, media_dir, quality, scene_name)
+        for cached in shared.glob("*.mp4"):
+            link_or_copy(cached, local / cached.name)
+
+
+def partial_movie_dir(code_path, media_dir, quality: str, scene_name: str) -> Path:
+    return Path(media_dir) / "videos" / Path(code_path).stem / QUALITY_DIRS[quality] / "partial_movie_files" / scene_name
+
+
+def harvest_partials(code_path, media_dir, quality: str = "l"):
+    """Move newly rendered partial movie files from a workspace into the shared cache."""
+    for scene_name in scene_names(Path(code_path).read_text()):
+        local = partial_movie_dir(code_path, media_dir, quality, scene_name)
+        if not local.is_dir():
+            continue
+        shared = PARTIALS_DIR / quality / scene_name
+        shared.mkdir(parents=True, exist_ok=True)
+        for partial in local.glob("*.mp4"):
+            cached = shared / partial.name
+            if cached.exists():
+                os.utime(cached)
+            else:
+                link_or_copy(partial, cached)
+    evict()
+
+
+def evict(max_bytes: int = RENDER_CACHE_MAX_BYTES, root=RENDER_CACHE_DIR):
+    """Delete least recently used files under root until it fits in max_bytes."""
+    with _evict_lock:
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
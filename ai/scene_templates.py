@@ -0,0 +1,312 @@
+"""Hand-written, parameterized manim scenes for common math topics.
+
+Rotation, reflection, translation, basic arithmetic and shape recognition
+requests are matched when the template is the whole subject of the topic:
+one of its subject words must appear and every other content word must belong
+to its vocabulary, so "area of a triangle" or "adding fractions" are left to
+full code generation. For those that match, the model only fills a template's
+small parameter model (angle, axis, colours, numbers, ...) instead of writing
+the whole scene, and the code is generated here from vetted building blocks.
+Parameters are validated by pydantic and inserted as literals, so the code
+always passes validation and identical parameters hit the render cache.
+"""
+import os
+import re
+from dataclasses import dataclass
+from string import Template
+from typing import Callable, List, Literal, Type
+
+from pydantic import BaseModel, Field
+
+SCENE_TEMPLATES = os.getenv("SCENE_TEMPLATES", "1") == "1"
+# share of the topic's content words a template's vocabulary must explain
+TEMPLATE_MIN_COVERAGE = float(os.getenv("TEMPLATE_MIN_COVERAGE", "1.0"))
+
+Color = Literal["BLUE", "RED", "GREEN", "YELLOW", "ORANGE", "PURPLE", "PINK", "TEAL", "GOLD", "MAROON"]
+ShapeName = Literal["triangle", "square", "rectangle", "pentagon", "hexagon", "circle"]
+
+# manim expression of every shape, centred on the origin
+SHAPES = {
+    "triangle": "Polygon([-1, -0.75, 0], [0, 1.25, 0], [1, -0.75, 0], color={color})",
+    "square": "Square(side_length=1.6, color={color})",
+    "rectangle": "Rectangle(width=2.4, height=1.4, color={color})",
+    "pentagon": "RegularPolygon(n=5, color={color}).scale(1.1)",
+    "hexagon": "RegularPolygon(n=6, color={color}).scale(1.1)",
+    "circle": "Circle(radius=1, color={color})",
+}
+SIDES = {"triangle": 3, "square": 4, "rectangle": 4, "pentagon": 5, "hexagon": 6, "circle": 0}
+
+# words that say nothing about the subject of a topic
+FILLER = re.compile(
+    r"(a|an|the|of|and|or|in|on|with|to|for|by|using|how|what|is|are|do|does|we|it|its|basic|basics|simple|"
+    r"introduction|intro|learn|learning|understanding|explained|explaining|kids|students?|grade|class|"
+    r"examples?|video|lesson|\d+(st|nd|rd|th))"
+)
+SHAPE_WORDS = r"(shapes?|figures?|objects?|polygons?|triangles?|squares?|rectangles?|circles?|pentagons?|hexagons?|2d|geometric|geometry)"
+_TOKEN = re.compile(r"[a-z0-9]+|[-+×÷*/=]")
+
+HEADER = '''from manim import *
+
+
+class Video(Scene):
+    def construct(self):
+        self.show_title()
+        self.show_topic()
+
+    def show_title(self):
+        title = Text($title, font_size=40)
+        self.play(Write(title))
+        self.wait(1)
+        self.play(FadeOut(title))
+'''
+
+GRID = '''        plane = NumberPlane(x_range=[-7, 7, 1], y_range=[-4, 4, 1], x_length=14, y_length=8,
+                            background_line_style={"stroke_opacity": 0.3})
+        self.play(Create(plane))
+'''
+
+
+def shape_code(shape: str, color: str, position=(0, 0)) -> str:
+    return f"{SHAPES[shape].format(color=color)}.move_to([{position[0]}, {position[1]}, 0])"
+
+
+def fill(template: str, **values) -> str:
+    return Template(template).substitute(**values)
+
+
+class RotationParams(BaseModel):
+    title: str = Field(description="Short on-screen title", max_length=60)
+    shape: ShapeName = Field(default="triangle", description="Shape that is rotated")
+    angle_degrees: int = Field(default=90, ge=-360, le=360, description="Rotation angle, positive is anticlockwise")
+    color: Color = Field(default="GREEN", description="Colour of the original shape")
+    result_color: Color = Field(default="ORANGE", description="Colour of the rotated shape")
+
+
+def rotation_code(p: RotationParams) -> str:
+    return fill(HEADER, title=repr(p.title)) + fill('''
+    def show_topic(self):
+$grid
+        shape = $shape
+        label = Text("Original", font_size=24, color=$color).next_to(shape, DOWN)
+        self.play(Create(shape), Write(label))
+        centre = Dot(ORIGIN, color=WHITE)
+        self.play(FadeIn(centre))
+        image = shape.copy().set_color($result_color)
+        self.play(Rotate(image, angle=$angle * DEGREES, about_point=ORIGIN), run_time=2)
+        result = Text($result_text, font_size=24, color=$result_color).next_to(image, DOWN)
+        self.play(Write(result))
+        self.wait(2)
+''', grid=GRID.rstrip("\n"), shape=shape_code(p.shape, p.color, (2, 1.5)), color=p.color,
+        result_color=p.result_color, angle=p.angle_degrees,
+        result_text=repr(f"Rotated {p.angle_degrees}° about the origin"))
+
+
+class ReflectionParams(BaseModel):
+    title: str = Field(description="Short on-screen title", max_length=60)
+    shape: ShapeName = Field(default="triangle", description="Shape that is reflected")
+    axis: Literal["x", "y", "y=x"] = Field(default="y", description="Mirror line: the x-axis, the y-axis or y=x")
+    color: Color = Field(default="GREEN", description="Colour of the original shape")
+    result_color: Color = Field(default="RED", description="Colour of the reflected shape")
+
+
+MIRRORS = {
+    "x": ("[[1, 0], [0, -1]]", "[-7, 0, 0]", "[7, 0, 0]", (2.5, 1.5)),
+    "y": ("[[-1, 0], [0, 1]]", "[0, -4, 0]", "[0, 4, 0]", (2.5, 1.5)),
+    "y=x": ("[[0, 1], [1, 0]]", "[-4, -4, 0]", "[4, 4, 0]", (2.5, 0.5)),
+}
+
+
+def reflection_code(p: ReflectionParams) -> str:
+    matrix, start, end, position = MIRRORS[p.axis]
+    return fill(HEADER, title=repr(p.title)) + fill('''
+    def show_topic(self):
+$grid
+        mirror = DashedLine($start, $end, color=WHITE)
+        mirror_label = Text($mirror_text, font_size=24).next_to(mirror.get_end(), LEFT)
+        self.play(Create(mirror), Write(mirror_label))
+        shape = $shape
+        label = Text("Original", font_size=24, color=$color).next_to(shape, DOWN)
+        self.play(Create(shape), Write(label))
+        image = shape.copy().set_color($result_color).apply_matrix($matrix, about_point=ORIGIN)
+        self.play(TransformFromCopy(shape, image), run_time=2)
+        result = Text("Reflection", font_size=24, color=$result_color).next_to(image, DOWN)
+        self.play(Write(result))
+        self.wait(2)
+''', grid=GRID.rstrip("\n"), start=start, end=end, mirror_text=repr(f"mirror: {p.axis if p.axis == 'y=x' else p.axis + '-axis'}"),
+        shape=shape_code(p.shape, p.color, position), color=p.color, result_color=p.result_color, matrix=matrix)
+
+
+class TranslationParams(BaseModel):
+    title: str = Field(description="Short on-screen title", max_length=60)
+    shape: ShapeName = Field(default="square", description="Shape that is translated")
+    dx: int = Field(default=4, ge=-6, le=6, description="Units moved to the right (negative is left)")
+    dy: int = Field(default=2, ge=-3, le=3, description="Units moved up (negative is down)")
+    color: Color = Field(default="BLUE", description="Colour of the original shape")
+    result_color: Color = Field(default="YELLOW", description="Colour of the translated shape")
+
+
+def translation_code(p: TranslationParams) -> str:
+    # start so that the shape and its image are both centred in the frame
+    start = (-p.dx / 2, -p.dy / 2)
+    return fill(HEADER, title=repr(p.title)) + fill('''
+    def show_topic(self):
+$grid
+        shape = $shape
+        label = Text("Original", font_size=24, color=$color).next_to(shape, DOWN)
+        self.play(Create(shape), Write(label))
+        image = shape.copy().set_color($result_color)
+        arrow = Arrow(shape.get_center(), shape.get_center() + [$dx, $dy, 0], buff=0, color=WHITE)
+        self.play(GrowArrow(arrow))
+        self.play(image.animate.shift([$dx, $dy, 0]), run_time=2)
+        result = Text($result_text, font_size=24, color=$result_color).next_to(image, DOWN)
+        self.play(Write(result))
+        self.wait(2)
+''', grid=GRID.rstrip("\n"), shape=shape_code(p.shape, p.color, start), color=p.color, result_color=p.result_color,
+        dx=p.dx, dy=p.dy, result_text=repr(f"Moved {p.dx} right, {p.dy} up"))
+
+
+class ArithmeticParams(BaseModel):
+    title: str = Field(description="Short on-screen title", max_length=60)
+    operation: Literal["+", "-", "x", "/"] = Field(default="+", description="The operation shown")
+    a: int = Field(default=3, ge=0, le=999, description="First number")
+    b: int = Field(default=4, ge=1, le=999, description="Second number")
+    color: Color = Field(default="BLUE", description="Colour of the first number")
+    second_color: Color = Field(default="YELLOW", description="Colour of the second number")
+
+
+def arithmetic_result(p: ArithmeticParams) -> str:
+    if p.operation == "+":
+        return str(p.a + p.b)
+    if p.operation == "-":
+        return str(p.a - p.b)
+    if p.operation == "x":
+        return str(p.a * p.b)
+    quotient, remainder = divmod(p.a, p.b)
+    return f"{quotient} remainder {remainder}" if remainder else str(quotient)
+
+
+def arithmetic_code(p: ArithmeticParams) -> str:
+    symbol = {"+": "+", "-": "-", "x": "×", "/": "÷"}[p.operation]
+    code = fill(HEADER, title=repr(p.title)) + fill('''
+    def show_topic(self):
+        question = Text($question, font_size=64)
+        self.play(Write(question))
+        self.wait(1)
+        self.play(question.animate.to_edge(UP))
+''', question=repr(f"{p.a} {symbol} {p.b}"))
+    # small sums and differences are also shown as counters
+    if (p.operation == "+" or (p.operation == "-" and p.a >= p.b)) and p.a <= 10 and p.b <= 10:
+        code += fill('''        first = VGroup(*[Dot(color=$color) for _ in range($a)]).arrange(RIGHT, buff=0.3)
+        second = VGroup(*[Dot(color=$second_color) for _ in range($b)]).arrange(RIGHT, buff=0.3)
+        VGroup(first, second).arrange(DOWN, buff=0.8)
+        self.play(LaggedStartMap(FadeIn, first), LaggedStartMap(FadeIn, second))
+        self.wait(1)
+''', color=p.color, second_color=p.second_color, a=p.a, b=p.b)
+        if p.operation == "+":
+            code += '''        self.play(second.animate.next_to(first, RIGHT, buff=0.3))
+'''
+        else:
+            code += '''        self.play(*[FadeOut(dot) for dot in first[len(first) - len(second):]], FadeOut(second))
+'''
+    code += fill('''        answer = Text($answer, font_size=64, color=$second_color).to_edge(DOWN)
+        self.play(Write(answer))
+        self.wait(2)
+''', answer=repr(f"{p.a} {symbol} {p.b} = {arithmetic_result(p)}"), second_color=p.second_color)
+    return code
+
+
+class ShapesParams(BaseModel):
+    title: str = Field(description="Short on-screen title", max_length=60)
+    shapes: List[ShapeName] = Field(default=["triangle", "square", "pentagon"], min_length=1, max_length=4,
+                                    description="Shapes introduced one after another")
+    color: Color = Field(default="TEAL", description="Colour of the shapes")
+
+
+def shapes_code(p: ShapesParams) -> str:
+    code = fill(HEADER, title=repr(p.title)) + '''
+    def show_topic(self):
+        shapes = VGroup()
+'''
+    spacing = 3.2
+    for i, shape in enumerate(p.shapes):
+        x = (i - (len(p.shapes) - 1) / 2) * spacing
+        sides = SIDES[shape]
+        caption = f"{shape}\n{sides} sides" if sides else f"{shape}\nno corners"
+        code += fill('''        shape = $shape
+        name = Text($caption, font_size=24).next_to(shape, DOWN)
+        self.play(Create(shape), Write(name))
+        shapes.add(shape, name)
+''', shape=shape_code(shape, p.color, (x, 0.5)), caption=repr(caption))
+    code += '''        self.play(Indicate(shapes))
+        self.wait(2)
+'''
+    return code
+
+
+@dataclass
+class SceneTemplate:
+    name: str
+    # one of these words must be in the topic
+    subject: str
+    # the other content words of the topic must be one of these
+    vocabulary: str
+    params: Type[BaseModel]
+    build: Callable[[BaseModel], str]
+
+    def coverage(self, words: list) -> float:
+        """Share of words the template explains, 0 when its subject is missing."""
+        if not words or not any(re.fullmatch(self.subject, word) for word in words):
+            return 0.0
+        known = sum(1 for word in words if re.fullmatch(self.subject, word) or re.fullmatch(self.vocabulary, word))
+        return known / len(words)
+
+
+TEMPLATES = [
+    SceneTemplate("rotation", r"(rotations?|rotating|rotates?|rotational)",
+                  rf"({SHAPE_WORDS}|\d+|degrees?|angles?|about|around|origin|point|centre|center|clockwise|"
+                  r"counterclockwise|anticlockwise|counter|anti|turns?|quarter|half|full|transformations?|"
+                  r"coordinate|plane|grid)",
+                  RotationParams, rotation_code),
+    SceneTemplate("reflection", r"(reflections?|reflecting|reflects?|reflected|mirror|mirroring)",
+                  rf"({SHAPE_WORDS}|x|y|axis|axes|line|lines|over|across|symmetry|symmetric|images?|flips?|"
+                  r"flipping|transformations?|coordinate|plane|grid|horizontal|vertical)",
+                  ReflectionParams, reflection_code),
+    SceneTemplate("translation", r"(translations?|translating|translates?|translated)",
+                  rf"({SHAPE_WORDS}|\d+|units?|left|right|up|down|slide|slides|sliding|moving|move|vectors?|"
+                  r"transformations?|coordinate|plane|grid)",
+                  TranslationParams, translation_code),
+    SceneTemplate("arithmetic", r"(add|adding|addition|subtract|subtracting|subtraction|multiply|multiplying|"
+                                r"multiplication|divide|dividing|division|arithmetic|times|x|[-+×÷*/])",
+                  r"(\d+|x|times|plus|minus|equals?|=|sum|difference|product|quotient|numbers?|whole|digits?|"
+                  r"single|double|two|three|small|operations?|add|adding|addition|subtract|subtracting|"
+                  r"subtraction|multiply|multiplying|multiplication|divide|dividing|division|[-+×÷*/])",
+                  ArithmeticParams, arithmetic_code),
+    SceneTemplate("shapes", r"(shapes?|polygons?|triangles?|squares?|rectangles?|circles?|pentagons?|hexagons?)",
+                  rf"({SHAPE_WORDS}|2d|names?|naming|identify|identifying|recogni[sz]e|recogni[sz]ing|sides?|"
+                  r"corners?|types?|kinds?|different|common|regular|flat|plane)",
+                  ShapesParams, shapes_code),
+]
+
+
+def topic_words(topic: str) -> list:
+    """Content words of a topic, parenthesized remarks and filler words removed."""
+    topic = re.sub(r"\([^)]*\)", " ", topic.lower())
+    # x-axis, 2-dimensional: a hyphen inside a word is not a minus sign
+    topic = re.sub(r"(?<=[a-z0-9])-(?=[a-z])", " ", topic)
+    return [word for word in _TOKEN.findall(topic) if not re.fullmatch(FILLER, word)]
+
+
+def match_template(topic: str):
+    """The template that covers the topic best, at least TEMPLATE_MIN_COVERAGE, or None.
+
+    Earlier templates win ties.
+    """
+    if not SCENE_TEMPLATES:
+        return None
+    words = topic_words(topic)
+    best, best_score = None, 0.0
+    for template in TEMPLATES:
+        score = template.coverage(words)
+        if score >= TEMPLATE_MIN_COVERAGE and score > best_score:
+            best, best_score = template, score
+    return best
@@ -0,0 +1,186 @@
+"""Where finished media is published.
+
+STORAGE_BACKEND=cloudinary (the default) uploads to Cloudinary. STORAGE_BACKEND=local
+copies files under STATIC_DIR, which main.py serves at /static, as a stand-in
+for Cloudinary in tests and on-prem installs.
+
+Uploads without an explicit public_id are content addressed: the SHA-256 of the
+file is the asset name and already published hashes are answered from a
+SQLite index shared by every process on the host, so identical outputs are
+never uploaded twice. Large files go to
+Cloudinary as chunks uploaded in parallel.
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cloudinary.uploader
+
+from executor import run_io
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary")
+STATIC_DIR = Path(os.getenv("STATIC_DIR", Path(__file__).parent / "static"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000").rstrip("/")
+STORAGE_INDEX_PATH = Path(os.getenv("STORAGE_INDEX_PATH", Path(__file__).parent / "storage_index.db"))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(20 * 1024 ** 2)))
+UPLOAD_PARALLEL_CHUNKS = int(os.getenv("UPLOAD_PARALLEL_CHUNKS", "4"))
+CLOUDINARY_FOLDER = os.getenv("CLOUDINARY_FOLDER", "educational-videos")
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadIndex:
+    """Persistent map of (backend, resource type, content hash) to published URL."""
+
+    def __init__(self, path=STORAGE_INDEX_PATH):
+        self.path = Path(path)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS uploads (key TEXT PRIMARY KEY, url TEXT NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT url FROM uploads WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, url: str):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO uploads (key, url) VALUES (?, ?)", (key, url))
+
+
+class StorageBackend:
+    name = "base"
+
+    def __init__(self, index: UploadIndex = None):
+        self.index = index or UploadIndex()
+
+    def upload(self, path, resource_type: str, public_id: str = None) -> str:
+        """Publish path and return its public URL.
+
+        Uploading again with the same public_id replaces the earlier file, which
+        is how growing manifests are republished. Without a public_id the file
+        is stored under its content hash and deduplicated.
+        """
+        if public_id is not None:
+            return self._put(path, resource_type, public_id)
+        content_hash = file_sha256(path)
+        key = f"{self.name}:{resource_type}:{content_hash}"
+        url = self.index.get(key)
+        if url is None or not self._exists(url):
+            url = self._put(path, resource_type, content_hash)
+            self.index.put(key, url)
+        return url
+
+    def _exists(self, url: str) -> bool:
+        return True
+
+    def _put(self, path, resource_type: str, public_id: str) -> str:
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root=STATIC_DIR, base_url=f"{PUBLIC_BASE_URL}/static", index=None):
+        super().__init__(index)
+        self.root = Path(root)
+        self.base_url = base_url
+
+    def _exists(self, url: str) -> bool:
+        return (self.root / url[len(self.base_url) + 1:]).exists()
+
+    def _put(self, path, resource_type: str, public_id: str) -> str:
+        name = public_id
+        if not Path(name).suffix:
+            name += Path(path).suffix
+        destination = self.root / name
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, destination)
+        return f"{self.base_url}/{name}"
+
+
+class CloudinaryStorage(StorageBackend):
+    name = "cloudinary"
+
+    def __init__(self, folder=CLOUDINARY_FOLDER, chunk_bytes=UPLOAD_CHUNK_BYTES,
+                 parallel_chunks=UPLOAD_PARALLEL_CHUNKS, index=None):
+        super().__init__(index)
+        self.folder = folder
+        self.chunk_bytes = chunk_bytes
+        self.parallel_chunks = parallel_chunks
+
+    def _put(self, path, resource_type: str, public_id: str) -> str:
+        options = {
+            "resource_type": resource_type,
+            "public_id": f"{self.folder}/{public_id}" if self.folder else public_id,
+            "overwrite": True,
+            "invalidate": True,
+        }
+        if os.path.getsize(path) <= self.chunk_bytes:
+            result = cloudinary.uploader.upload(str(path), **options)
+        else:
+            result = self._upload_chunked(path, options)
+        return result["secure_url"]
+
+    def _upload_chunked(self, path, options: dict):
+        """Upload the file in chunks, all but the last in parallel.
+
+        Cloudinary assembles chunks sharing an X-Unique-Upload-Id and finalises
+        the asset when the chunk ending at the last byte arrives, so that one is
+        sent only after every other chunk has been accepted.
+        """
+        size = os.path.getsize(path)
+        upload_id = uuid.uuid4().hex
+        filename = Path(path).name
+        ranges = [(start, min(start + self.chunk_bytes, size)) for start in range(0, size, self.chunk_bytes)]
+
+        def send(chunk_range):
+            start, end = chunk_range
+            with open(path, "rb") as f:
+                f.seek(start)
+                chunk = f.read(end - start)
+            headers = {"Content-Range": f"bytes {start}-{end - 1}/{size}", "X-Unique-Upload-Id": upload_id}
+            return cloudinary.uploader.upload_large_part((filename, chunk), http_headers=headers, **options)
+
+        with ThreadPoolExecutor(max_workers=self.parallel_chunks) as pool:
+            list(pool.map(send, ranges[:-1]))
+        return send(ranges[-1])
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalStorage() if STORAGE_BACKEND == "local" else CloudinaryStorage()
+    return _backend
+
+
+def upload_file(path, resource_type: str, public_id: str = None) -> str:
+    """Publish path with the configured backend and return its public URL."""
+    return get_storage().upload(path, resource_type, public_id)
+
+
+async def upload_files(*uploads) -> list:
+    """Run several (path, resource_type) uploads concurrently, returning URLs in order."""
+    return list(await asyncio.gather(*(run_io(upload_file, path, resource_type) for path, resource_type in uploads)))
@@ -0,0 +1,142 @@
+"""Schema-enforced LLM output, parsed while it streams.
+
+The pydantic model is passed to the chat model as the only tool it may call,
+so the JSON schema travels as a function definition instead of long format
+instructions in the prompt, and the answer is always the model's arguments.
+The arguments are streamed through JsonStreamParser, which reports every
+top-level field and every item of a top-level list as soon as it is complete,
+so callers can start rendering, TTS or image work before the rest arrives.
+"""
+import json
+
+
+class JsonStreamParser:
+    """Incremental parser for one JSON object arriving in pieces.
+
+    feed() returns (key, index, value) for each newly completed top-level value,
+    with index None, and for each completed item of a top-level list, with the
+    item's index. Values are decoded with json.loads.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._after_colon = False
+        self._value_start = None
+        self._value_depth = None
+        self._item_start = None
+        self._item_index = 0
+        self._in_list = False
+
+    def feed(self, text: str) -> list:
+        events = []
+        self.buffer += text
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._close_string(events)
+                self._pos += 1
+                continue
+            if char == '"':
+                self._in_string = True
+                self._mark_start()
+                if self._depth == 1 and not self._after_colon:
+                    self._key_start = self._pos
+            elif char in "{[":
+                self._mark_start()
+                self._depth += 1
+                if self._depth == 2 and char == "[" and self._value_start == self._pos:
+                    self._in_list = True
+                    self._item_index = 0
+            elif char in "}]":
+                self._end_primitive(events)
+                self._depth -= 1
+                if self._depth == 2 and self._in_list and self._item_start is not None:
+                    self._emit_item(events, self._pos + 1)
+                elif self._depth == 1 and self._value_start is not None:
+                    self._emit_value(events, self._pos + 1)
+            elif char == ":" and self._depth == 1:
+                self._after_colon = True
+            elif char == ",":
+                self._end_primitive(events)
+            elif not char.isspace():
+                self._mark_start()
+            self._pos += 1
+        return events
+
+    def _mark_start(self):
+        if self._depth == 1 and self._after_colon and self._value_start is None:
+            self._value_start = self._pos
+        elif self._depth == 2 and self._in_list and self._item_start is None:
+            self._item_start = self._pos
+
+    def _close_string(self, events):
+        if self._depth == 1 and self._key_start is not None and not self._after_colon:
+            self._key = json.loads(self.buffer[self._key_start:self._pos + 1])
+            self._key_start = None
+        elif self._depth == 1 and self._value_start is not None:
+            self._emit_value(events, self._pos + 1)
+        elif self._depth == 2 and self._in_list and self._item_start is not None:
+            self._emit_item(events, self._pos + 1)
+
+    def _end_primitive(self, events):
+        """Numbers, booleans and null end at the next comma or closing bracket."""
+        if self._depth == 1 and self._value_start is not None:
+            self._emit_value(events, self._pos)
+        elif self._depth == 2 and self._in_list and self._item_start is not None:
+            self._emit_item(events, self._pos)
+
+    def _emit_value(self, events, end):
+        events.append((self._key, None, json.loads(self.buffer[self._value_start:end])))
+        self._value_start = None
+        self._after_colon = False
+        self._in_list = False
+
+    def _emit_item(self, events, end):
+        events.append((self._key, self._item_index, json.loads(self.buffer[self._item_start:end])))
+        self._item_start = None
+        self._item_index += 1
+
+
+def bind_schema(llm, schema):
+    """The chat model forced to answer by calling schema as a tool."""
+    return llm.bind_tools([schema], tool_choice=schema.__name__)
+
+
+def parse_tool_call(message, schema):
+    """The schema instance from a (non-streamed) tool calling answer."""
+    if not message.tool_calls:
+        raise ValueError(f"The model did not return {schema.__name__}")
+    return schema(**message.tool_calls[0]["args"])
+
+
+async def stream_structured(llm, messages, schema, on_field=None):
+    """Stream an answer shaped like schema, awaiting on_field(key, index, value) as parts complete.
+
+    Returns (schema instance, aggregated message) so the caller can count tokens.
+    """
+    parser = JsonStreamParser()
+    arguments = []
+    message = None
+    async for chunk in bind_schema(llm, schema).astream(messages):
+        message = chunk if message is None else message + chunk
+        for tool_chunk in chunk.tool_call_chunks:
+            piece = tool_chunk.get("args") or ""
+            arguments.append(piece)
+            for key, index, value in parser.feed(piece):
+                if on_field is not None:
+                    await on_field(key, index, value)
+    if message is None or not arguments:
+        raise ValueError(f"The model did not return {schema.__name__}")
+    return schema(**json.loads("".join(arguments))), message
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app's modules are imported flat from ai/, as main.py does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import jobs
+from jobs import JobQueue, JobStore, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+
+def test_a_leased_job_is_not_claimed_by_another_process(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit("math_video", {})
+    assert store.claim("a")["id"] == job_id
+    assert store.claim("b") is None
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_an_expired_lease_is_claimed_again(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit("math_video", {})
+    store.claim("a", lease_seconds=0.05)
+    time.sleep(0.1)
+    assert store.claim("b")["id"] == job_id
+    assert not store.renew_lease(job_id, "a")
+    assert store.renew_lease(job_id, "b")
+
+
+def test_a_job_that_keeps_losing_its_process_fails(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit("math_video", {})
+    for owner in ("a", "b"):
+        assert store.claim(owner, lease_seconds=0.05, max_attempts=2) is not None
+        time.sleep(0.1)
+    assert store.claim("c", max_attempts=2) is None
+    job = store.get(job_id)
+    assert job["status"] == FAILED and "2 attempts" in job["error"]
+
+
+def test_release_requeues_without_counting_the_attempt(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit("math_video", {})
+    store.claim("a", max_attempts=1)
+    store.release(job_id, "a")
+    assert store.get(job_id)["status"] == QUEUED
+    assert store.claim("b", max_attempts=1)["id"] == job_id
+
+
+def test_a_queue_only_claims_its_own_kinds(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    upgrade_id = store.submit("quality_upgrade", {})
+    job_id = store.submit("math_video", {})
+    assert store.claim("a", ["math_video"])["id"] == job_id
+    assert store.claim("a", ["math_video"]) is None
+    assert store.claim("b", ["quality_upgrade"])["id"] == upgrade_id
+
+
+def test_a_process_that_lost_the_lease_cannot_overwrite_the_job(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.submit("math_video", {})
+    store.claim("a", lease_seconds=0.05)
+    time.sleep(0.1)
+    store.claim("b")
+    assert not store.update_progress(job_id, "a", "render", 0.5)
+    assert not store.finish(job_id, "a", {"from": "a"})
+    assert not store.fail(job_id, "a", "late")
+    assert store.finish(job_id, "b", {"from": "b"})
+    job = store.get(job_id)
+    assert job["status"] == SUCCEEDED
+    assert job["result"] == {"from": "b"}
+
+
+def test_losing_the_lease_stops_the_handler(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.03)
+    store = JobStore(str(tmp_path / "jobs.db"))
+    stopped = []
+
+    async def handler(payload, report):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            stopped.append(True)
+            raise
+
+    async def run():
+        queue = JobQueue(store, {"math_video": handler}, workers=0)
+        job_id = store.submit("math_video", {})
+        job = store.claim(queue.owner)
+        # another process takes the job over
+        monkeypatch.setattr(store, "renew_lease", lambda *args: False)
+        await asyncio.wait_for(queue._run(0, job), 5)
+        return job_id
+
+    job_id = asyncio.run(run())
+    assert stopped == [True]
+    assert store.get(job_id)["status"] == RUNNING
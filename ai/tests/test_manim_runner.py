@@ -0,0 +1,21 @@
+import asyncio
+
+from manim_runner import RenderSlots
+
+
+def test_render_slots_are_shared_between_processes(tmp_path):
+    # two instances stand for two app processes on the same host
+    first, second = RenderSlots(tmp_path, 1), RenderSlots(tmp_path, 1)
+    order = []
+
+    async def render(slots, name, seconds):
+        async with slots.hold():
+            order.append(f"{name} start")
+            await asyncio.sleep(seconds)
+            order.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(render(first, "a", 0.3), render(second, "b", 0))
+
+    asyncio.run(run())
+    assert order == ["a start", "a end", "b start", "b end"]
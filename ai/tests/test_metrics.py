@@ -0,0 +1,14 @@
+import metrics
+
+
+def test_memory_histograms_use_byte_buckets():
+    metrics.observe("test_peak_bytes", 300 * 1024 ** 2, buckets=metrics.MEMORY_BUCKETS, quality="l")
+    text = metrics.render_metrics()
+    assert 'test_peak_bytes_bucket{quality="l",le="268435456"} 0' in text
+    assert 'test_peak_bytes_bucket{quality="l",le="536870912"} 1' in text
+
+
+def test_a_stage_records_the_memory_sampled_around_it():
+    with metrics.stage("test_stage"):
+        pass
+    assert 'pipeline_stage_rss_bytes_count{stage="test_stage"} 1' in metrics.render_metrics()
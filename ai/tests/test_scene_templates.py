@@ -0,0 +1,55 @@
+import pytest
+
+from scene_templates import TEMPLATES, match_template
+
+
+@pytest.mark.parametrize("topic, name", [
+    ("rotation of shapes", "rotation"),
+    ("Rotating a triangle 90 degrees clockwise", "rotation"),
+    ("rotation of a triangle (variant 3)", "rotation"),
+    ("reflection over the x-axis", "reflection"),
+    ("reflection of a triangle across the y axis", "reflection"),
+    ("translation of shapes on a grid", "translation"),
+    ("adding two numbers", "arithmetic"),
+    ("addition and subtraction", "arithmetic"),
+    ("Multiplication for grade 3", "arithmetic"),
+    ("5 + 3", "arithmetic"),
+    ("3 x 4", "arithmetic"),
+    ("basic shapes for kids", "shapes"),
+    ("identifying 2D shapes", "shapes"),
+    ("types of polygons", "shapes"),
+])
+def test_topics_about_a_template_match_it(topic, name):
+    template = match_template(topic)
+    assert template is not None and template.name == name
+
+
+@pytest.mark.parametrize("topic", [
+    "area of a triangle",
+    "Pythagorean theorem for right triangles",
+    "perimeter of a rectangle",
+    "circumference of a circle",
+    "square numbers and square roots",
+    "probability of flipping a coin",
+    "adding fractions with unlike denominators",
+    "angles in a triangle add up to 180",
+    "sliding window",
+    "rotation and reflection of shapes",
+    "make a video showing the simulations of shapes rolling down the hill one after another",
+    "photosynthesis",
+    "",
+])
+def test_topics_that_only_mention_a_keyword_do_not_match(topic):
+    assert match_template(topic) is None
+
+
+def test_disabled_templates_never_match(monkeypatch):
+    monkeypatch.setattr("scene_templates.SCENE_TEMPLATES", False)
+    assert match_template("rotation of shapes") is None
+
+
+@pytest.mark.parametrize("template", TEMPLATES, ids=lambda template: template.name)
+def test_default_parameters_build_valid_code(template):
+    code = template.build(template.params(title="It's a {test}"))
+    compile(code, f"<{template.name}>", "exec")
+    assert "class Video(Scene)" in code
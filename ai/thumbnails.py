@@ -0,0 +1,107 @@
+"""Posters and a scrubbing sprite sheet cut from a rendered video.
+
+The poster frame is picked with ffmpeg's scene change score: the last settled
+frame before the cut closest to the middle of the video, which for manim
+renders and slideshows is a fully drawn step rather than a frame mid
+animation. Without a usable cut the middle frame is taken. The frame is
+scaled to every POSTER_WIDTHS in every POSTER_FORMATS in a single decode, and
+the sprite sheet tiles one small frame every few seconds into one JPEG.
+"""
+import math
+import os
+import re
+import subprocess
+from pathlib import Path
+
+from ffmpeg_tools import FFMPEG, media_duration, run_ffmpeg
+
+POSTER_WIDTHS = [int(w) for w in os.getenv("POSTER_WIDTHS", "320,640").split(",") if w.strip()]
+POSTER_FORMATS = [f.strip() for f in os.getenv("POSTER_FORMATS", "webp,jpg").split(",") if f.strip()]
+POSTER_QUALITY = int(os.getenv("POSTER_QUALITY", "75"))
+SCENE_CHANGE_THRESHOLD = float(os.getenv("SCENE_CHANGE_THRESHOLD", "0.3"))
+SPRITE_TILE_WIDTH = int(os.getenv("SPRITE_TILE_WIDTH", "160"))
+SPRITE_COLUMNS = int(os.getenv("SPRITE_COLUMNS", "10"))
+SPRITE_MAX_TILES = int(os.getenv("SPRITE_MAX_TILES", "100"))
+SPRITE_MIN_INTERVAL = float(os.getenv("SPRITE_MIN_INTERVAL", "1"))
+# how far before a cut the poster frame is taken, so the outgoing step is complete
+SETTLE_SECONDS = 0.5
+
+_PTS_TIME = re.compile(r"pts_time:(\d+(?:\.\d+)?)")
+_CODECS = {
+    "webp": ["-c:v", "libwebp", "-quality", str(POSTER_QUALITY)],
+    # ffmpeg's mjpeg scale runs from 2 (best) to 31
+    "jpg": ["-c:v", "mjpeg", "-q:v", str(max(2, round(31 - POSTER_QUALITY * 0.29)))],
+}
+
+
+def scene_changes(video_path) -> list:
+    """Timestamps of the cuts ffmpeg scores above SCENE_CHANGE_THRESHOLD."""
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-i", str(video_path),
+         # a small copy of each frame is enough to score cuts
+         "-vf", f"scale=160:-2,select='gt(scene,{SCENE_CHANGE_THRESHOLD})',showinfo",
+         "-an", "-f", "null", "-"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    if result.returncode != 0:
+        return []
+    return [float(t) for t in _PTS_TIME.findall(result.stderr)]
+
+
+def poster_time(video_path, duration: float) -> float:
+    """The settled frame before the cut nearest the middle, or the middle itself."""
+    middle = duration / 2
+    cuts = [t for t in scene_changes(video_path) if duration * 0.1 <= t <= duration * 0.9]
+    if not cuts:
+        return middle
+    return max(min(cuts, key=lambda t: abs(t - middle)) - SETTLE_SECONDS, 0.0)
+
+
+def make_posters(video_path, at: float, out_dir: Path) -> list:
+    """(width, format, path) of every poster, decoding the frame at `at` once."""
+    widths = sorted(set(POSTER_WIDTHS))
+    outputs = [(width, fmt) for fmt in POSTER_FORMATS for width in widths]
+    labels = "".join(f"[p{i}]" for i in range(len(outputs)))
+    graph = [f"[0:v]split={len(outputs)}{labels}"]
+    output_args = []
+    posters = []
+    for i, (width, fmt) in enumerate(outputs):
+        if fmt not in _CODECS:
+            raise ValueError(f"Unsupported poster format {fmt}")
+        # never upscale a small render
+        graph.append(f"[p{i}]scale='min(iw,{width})':-2[o{i}]")
+        path = out_dir / f"poster_{width}.{fmt}"
+        output_args += ["-map", f"[o{i}]", "-frames:v", "1", *_CODECS[fmt], str(path)]
+        posters.append((width, fmt, path))
+    run_ffmpeg(["-ss", f"{at:.3f}", "-i", str(video_path), "-filter_complex", ";".join(graph), *output_args])
+    return posters
+
+
+def make_sprite_sheet(video_path, duration: float, out_path: Path) -> dict:
+    """Tile a frame every `interval` seconds into one JPEG, row by row."""
+    interval = max(duration / SPRITE_MAX_TILES, SPRITE_MIN_INTERVAL)
+    tiles = max(1, math.ceil(duration / interval))
+    columns = min(SPRITE_COLUMNS, tiles)
+    rows = math.ceil(tiles / columns)
+    run_ffmpeg([
+        "-i", str(video_path),
+        "-vf", f"fps=1/{interval:.6f},scale={SPRITE_TILE_WIDTH}:-2,tile={columns}x{rows}",
+        "-frames:v", "1", "-q:v", "5", "-an",
+        str(out_path),
+    ])
+    return {"path": out_path, "interval": interval, "tiles": tiles, "columns": columns, "rows": rows,
+            "tile_width": SPRITE_TILE_WIDTH}
+
+
+def make_thumbnails(video_path, out_dir) -> dict:
+    """Posters and sprite sheet of video_path, written to out_dir.
+
+    Returns {"posters": [(width, format, path)], "sprite": {...}}.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    duration = media_duration(video_path)
+    return {
+        "posters": make_posters(video_path, poster_time(video_path, duration), out_dir),
+        "sprite": make_sprite_sheet(video_path, duration, out_dir / "sprite.jpg"),
+    }
@@ -0,0 +1,79 @@
+"""Content-addressed cache for synthesized narration.
+
+Audio is stored under the SHA-256 of the text, voice and model, so retries and
+repeated scripts never call the TTS API again. Long narrations are split into
+sentence groups that are synthesized and cached one by one, which lets the
+pieces run in parallel and lets an edited narration reuse its unchanged
+sentences. The cache is kept under TTS_CACHE_MAX_BYTES by LRU eviction.
+"""
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+from render_cache import evict as evict_lru
+
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", Path(__file__).parent / "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("TTS_VOICE", "alloy")
+# sentences are grouped up to this many characters per request, fewer calls keep the prosody natural
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "400"))
+# hard limit of the speech endpoint
+TTS_MAX_INPUT_CHARS = 4096
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list:
+    """Split text at sentence boundaries into chunks of at most max_chars where possible."""
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+        # a single sentence longer than the endpoint accepts is cut at a word boundary
+        while len(current) > TTS_MAX_INPUT_CHARS:
+            cut = current.rfind(" ", 0, TTS_MAX_INPUT_CHARS)
+            cut = cut if cut > 0 else TTS_MAX_INPUT_CHARS
+            chunks.append(current[:cut])
+            current = current[cut:].lstrip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def audio_key(text: str, voice: str = TTS_VOICE, model: str = TTS_MODEL) -> str:
+    digest = hashlib.sha256()
+    for part in (text.strip(), voice, model):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def lookup(key: str):
+    """Return the cached audio for key, or None. A hit refreshes its LRU position."""
+    path = TTS_CACHE_DIR / f"{key}.mp3"
+    if not path.exists():
+        return None
+    os.utime(path)
+    return path
+
+
+def tmp_path(key: str) -> Path:
+    """Private path inside the cache directory to write a synthesis to before store()."""
+    TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return TTS_CACHE_DIR / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.mp3"
+
+
+def store(key: str, audio_path):
+    """Move a finished synthesis from tmp_path(key) into the cache and return its cached path."""
+    path = TTS_CACHE_DIR / f"{key}.mp3"
+    os.replace(audio_path, path)
+    evict_lru(TTS_CACHE_MAX_BYTES, TTS_CACHE_DIR)
+    return path
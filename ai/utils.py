@@ -3,27 +3,86 @@ import os
 import re
 import time
 import json
+import random
 import openai
 from openai import OpenAI
 from dotenv import load_dotenv
 from pathlib import Path
-import requests
 import time
-from moviepy.editor import VideoFileClip, AudioFileClip
+
+import render_cache
+import tts_cache
+from concurrent.futures import ThreadPoolExecutor
+from downloader import download_file, write_base64
+from executor import run_io
+from ffmpeg_tools import concat_copy
+from manim_runner import render_file
+from manim_validation import validate
+from metrics import stage, inc
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Retries are handled by with_backoff so rate limits honour retry-after
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
-async def run_manim(output_file):
-    try:
-        # Run the manim command with the specified output file
-        os.system(f'manim manim_code.py -ql -o {output_file}')
-        print("Manim execution completed successfully")
-    except Exception as e:
-        print(f"Error running Manim: {str(e)}")
-        raise
+# Upper bound on simultaneous OpenAI / download calls made by the fan-out stage
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "4"))
+# "url" downloads each image, "b64_json" returns it inline with the API response
+IMAGE_RESPONSE_FORMAT = os.getenv("IMAGE_RESPONSE_FORMAT", "b64_json")
+# parallel speech requests per narration
+TTS_PARALLEL_CHUNKS = int(os.getenv("TTS_PARALLEL_CHUNKS", "4"))
+# How many times a rate-limited call is retried before giving up
+MAX_BACKOFF_RETRIES = int(os.getenv("MAX_BACKOFF_RETRIES", "5"))
+MAX_BACKOFF_SECONDS = float(os.getenv("MAX_BACKOFF_SECONDS", "30"))
+
+
+def with_backoff(fn, *args, **kwargs):
+    """Call fn, retrying with exponential backoff when the API rate limits us."""
+    for attempt in range(MAX_BACKOFF_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            retry_after = None
+            response = getattr(e, "response", None)
+            if response is not None:
+                retry_after = response.headers.get("retry-after")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = min(2 ** attempt, MAX_BACKOFF_SECONDS) + random.random()
+            print(f"Rate limited ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return fn(*args, **kwargs)
+
+async def run_manim(code_path, output_file, media_dir, quality="l", validate_code=True):
+    """Render code_path with manim and return the path of the rendered video.
+
+    Identical scene code is served from the render cache without rendering,
+    anything else is validated before the full render starts unless
+    validate_code is False, e.g. for code that already rendered at another quality.
+    """
+    code_path = Path(code_path)
+    video_path = Path(media_dir) / "videos" / code_path.stem / render_cache.QUALITY_DIRS[quality] / output_file
+    key = render_cache.render_key(code_path.read_text(), quality)
+    cached = await run_io(render_cache.lookup, key)
+    if cached is not None:
+        await run_io(render_cache.link_or_copy, cached, video_path)
+        inc("render_cache_hits_total")
+        print(f"Render cache hit for {output_file}")
+        return video_path
+
+    await run_io(render_cache.prepare_workspace, code_path, media_dir, quality)
+    # catch broken code in seconds before starting the real render
+    if validate_code:
+        with stage("manim_validate"):
+            await validate(code_path, media_dir)
+    with stage("manim_render", quality=quality):
+        await render_file(code_path, output_file, media_dir, video_path.parent, quality)
+    print("Manim execution completed successfully")
 
+    await run_io(render_cache.store, key, video_path)
+    await run_io(render_cache.harvest_partials, code_path, media_dir, quality)
+    return video_path
 
 
 def generate_safe_filename(title):
@@ -101,89 +160,119 @@ def generate_safe_filename(title):
 
 
 
-def generate_image(description: str, idx:int, n_files=5) -> str:
-    """Generate an image using DALL-E based on the scene description."""
-    try:
-        
+def request_images(description: str, n_files=5, response_format=IMAGE_RESPONSE_FORMAT) -> list:
+    """Ask DALL-E for n_files images of the description.
 
-        response = client.images.generate(
+    Returns the API's image objects, each with a url or, for
+    response_format="b64_json", the image itself.
+    """
+    response = with_backoff(
+        client.images.generate,
         model="dall-e-2",
         prompt=f"{description}",
         size="1024x1024",
         quality="standard",
         n=n_files,
-        )
+        response_format=response_format,
+    )
+    return list(response.data[:n_files])
 
-        files = []
-        for i in range(n_files):
-            image_url = response.data[i].url
-            image_filename = f"temp_img_{idx*n_files+i}.png"
-            save_image(image_url, image_filename)
-            files.append(image_filename)
-            
-        time.sleep(30)
-        return files
-    except Exception as e:
-        print(f"Error generating image: {str(e)}")
-        return ""
 
-def text_to_speech(narration: str, filename:str) -> str:
-    """Convert text to speech using Whisper."""
-    try:
-        speech_file_path = Path(__file__).parent / filename
-        response = client.audio.speech.create(
-        model="tts-1",
-        voice="alloy",
-        input=narration
-        )
-        response.stream_to_file(speech_file_path)
-        
-    except Exception as e:
-        print(f"Error converting text to speech: {str(e)}")
-        return ""
+async def bounded_call(semaphore, stage_name, fn, *args):
+    """Run a blocking call in the I/O pool once the semaphore admits it."""
+    async with semaphore:
+        with stage(stage_name):
+            return await run_io(fn, *args)
 
 
-def save_image(image_url: str, filename: str):
-    """Download and save the image from the given URL."""
-    try:
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            print(f"Image saved as: {filename}")
+async def generate_single_scene(idx, scene, workdir, semaphore, n_files=5):
+    """Generate one scene's images and narration audio concurrently.
+
+    Returns (image_files, audio_file).
+    """
+    async def fetch(image, filename):
+        if image.b64_json:
+            # the image came inline with the API response, no download needed
+            await run_io(write_base64, image.b64_json, filename)
         else:
-            print(f"Failed to download image: {response.status_code}")
-    except Exception as e:
-        print(f"Error saving image file: {str(e)}")
+            # downloads share the pooled client and its own concurrency bound
+            with stage("image_download"):
+                await download_file(image.url, filename)
+
+    async def scene_images():
+        images = await bounded_call(semaphore, "image_generation", request_images, scene[0], n_files)
+        if not images:
+            raise RuntimeError(f"No images were generated for scene {idx}")
+        files = [str(Path(workdir) / f"temp_img_{idx*n_files+i}.png") for i in range(len(images))]
+        await asyncio.gather(*(fetch(image, filename) for image, filename in zip(images, files)))
+        return files
+
+    async def scene_audio():
+        filename = str(Path(workdir) / f"temp_audio_{idx}.mp3")
+        await bounded_call(semaphore, "tts", text_to_speech, scene[1], filename)
+        return filename
+
+    return tuple(await asyncio.gather(scene_images(), scene_audio()))
 
-def add_audio_to_video(video_path: str, audio_path: str, output_path: str):
-    """Add audio to the video, trimming or silencing as necessary."""
+
+class SpeechError(RuntimeError):
+    pass
+
+
+def synthesize_chunk(text: str, voice: str = tts_cache.TTS_VOICE, model: str = tts_cache.TTS_MODEL) -> Path:
+    """Return the cached audio of text, calling the speech endpoint only on a miss."""
+    key = tts_cache.audio_key(text, voice, model)
+    cached = tts_cache.lookup(key)
+    if cached is not None:
+        inc("tts_cache_hits_total")
+        return cached
+    tmp_path = tts_cache.tmp_path(key)
     try:
-        # Load the video and audio files
-        video = VideoFileClip(video_path)
-        audio = AudioFileClip(audio_path)
+        response = with_backoff(
+            client.audio.speech.create,
+            model=model,
+            voice=voice,
+            input=text
+        )
+        response.stream_to_file(tmp_path)
+        return tts_cache.store(key, tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
-        # Set the audio to the video
-        video = video.set_audio(audio)
 
-        # Check lengths and adjust
-        if audio.duration < video.duration:
-            # If audio is shorter, keep the video length
-            final_video = video.set_duration(audio.duration)
-        else:
-            # If video is shorter, keep the video length and silence the rest
-            final_video = video.set_duration(video.duration)
+def text_to_speech(narration: str, filename:str, voice: str = tts_cache.TTS_VOICE, model: str = tts_cache.TTS_MODEL) -> str:
+    """Convert text to speech, sentence groups in parallel, reusing cached audio.
 
-        # Write the final video to a file
-        final_video.write_videofile(output_path, codec='libx264', audio_codec='aac')
+    Raises SpeechError if the narration can't be synthesized.
+    """
+    try:
+        speech_file_path = Path(filename)
+        key = tts_cache.audio_key(narration, voice, model)
+        cached = tts_cache.lookup(key)
+        if cached is None:
+            chunks = tts_cache.split_sentences(narration)
+            if len(chunks) <= 1:
+                cached = synthesize_chunk(narration, voice, model)
+            else:
+                with ThreadPoolExecutor(max_workers=min(TTS_PARALLEL_CHUNKS, len(chunks))) as pool:
+                    parts = list(pool.map(lambda chunk: synthesize_chunk(chunk, voice, model), chunks))
+                # the pieces share codec parameters, so they are joined without re-encoding
+                tmp_path = tts_cache.tmp_path(key)
+                try:
+                    concat_copy(parts, str(tmp_path))
+                    cached = tts_cache.store(key, tmp_path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
+        else:
+            inc("tts_cache_hits_total")
+        render_cache.link_or_copy(cached, speech_file_path)
+        return str(speech_file_path)
 
-        print(f"Video with audio saved as: {output_path}")
     except Exception as e:
-        print(f"Error adding audio to video: {str(e)}")
+        raise SpeechError(f"Error converting text to speech: {e}") from e
 
 
 if __name__ == "__main__":
-    generate_image("beautiful mountain")
     text_to_speech("hi this is anil the god of coding.")
     # asyncio.run(run_manim("test1"))
     # content = """
@@ -0,0 +1,69 @@
+"""Per-request scratch directories so concurrent renders never share files.
+
+Every pipeline run gets its own directory under WORKSPACE_ROOT that is removed
+when the run finishes, whether it succeeded or not. New workspaces are refused
+when the workspaces already use WORKSPACE_QUOTA_BYTES or the disk is nearly full.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from executor import run_io
+
+WORKSPACE_ROOT = Path(os.getenv("WORKSPACE_ROOT", Path(__file__).parent / "workspaces"))
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(10 * 1024 ** 3)))
+MIN_FREE_DISK_BYTES = int(os.getenv("MIN_FREE_DISK_BYTES", str(1024 ** 3)))
+
+# workspaces of runs in progress in this process, never swept by the janitor
+active_workspaces = set()
+
+
+class DiskQuotaExceeded(Exception):
+    pass
+
+
+def directory_size(path) -> int:
+    """Total size in bytes of all files below path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                # removed by a workspace that finished while we were walking
+                pass
+    return total
+
+
+def check_quota():
+    """Raise DiskQuotaExceeded if there is no room for another workspace."""
+    WORKSPACE_ROOT.mkdir(parents=True, exist_ok=True)
+    free = shutil.disk_usage(WORKSPACE_ROOT).free
+    if free < MIN_FREE_DISK_BYTES:
+        raise DiskQuotaExceeded(f"Only {free} bytes free on disk, need at least {MIN_FREE_DISK_BYTES}")
+    used = directory_size(WORKSPACE_ROOT)
+    if used >= WORKSPACE_QUOTA_BYTES:
+        raise DiskQuotaExceeded(f"Workspaces use {used} bytes, quota is {WORKSPACE_QUOTA_BYTES}")
+
+
+def create_workspace(prefix: str) -> Path:
+    check_quota()
+    return Path(tempfile.mkdtemp(prefix=f"{prefix}_", dir=WORKSPACE_ROOT))
+
+
+def remove_workspace(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@asynccontextmanager
+async def workspace(prefix: str = "job"):
+    """Yield a fresh directory for one request and delete it afterwards."""
+    path = await run_io(create_workspace, prefix)
+    active_workspaces.add(path)
+    try:
+        yield path
+    finally:
+        await run_io(remove_workspace, path)
+        active_workspaces.discard(path)